@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Startup time of the CLI tools. Checks that the modules import within a time budget and
+dont pull in the heavy dependencies (which should be imported only in the code paths that need them).
+Uses `python -X importtime`; the exit code is 1 when any budget is exceeded, so it can be run as a check.
+
+Usage:
+    $ python benchmarks/bench_import_time.py
+    $ python benchmarks/bench_import_time.py -scale 2     # relax the budgets on a slow machine
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+HEAVY = {'numpy', 'scipy', 'nltk', 'requests', 'lxml', 'networkx'}
+
+# module -> (budget in milli seconds, heavy modules it is allowed to import)
+BUDGETS = {
+    'metric': (100, set()),
+    'oov': (100, set()),
+    'solr': (100, set()),
+    'ngram_match': (100, set()),
+    'instrument': (50, set()),
+    'sink': (50, set()),
+    'elisa': (100, {'lxml'}),
+}
+
+# a strict metric run over a small file, end to end
+E2E_BUDGET = 1000
+
+
+def import_times(module, repeat=3):
+    """
+    :return: best cumulative import time of module in milli seconds, set of the top level packages it imported
+    """
+    env = dict(os.environ, PYTHONPATH=SRC)
+    best, packages = float('inf'), set()
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], env=env, cwd=SRC,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if proc.returncode != 0:
+            raise Exception('Cant import %s: %s' % (module, proc.stderr.strip().split('\n')[-1]))
+        # import time: self [us] | cumulative | imported package
+        for line in proc.stderr.split('\n'):
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            packages.add(name.strip().split('.')[0])
+            if name.strip() == module:
+                best = min(best, int(cumulative) / 1000)
+    return best, packages
+
+
+def e2e_time(repeat=3):
+    """
+    :return: best wall time in milli seconds of `metric.py strict` on a small file
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False) as f:
+        for i in range(100):
+            f.write('word%d\tword%d\n' % (i, i % 7))
+    try:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with open(f.name) as inp:
+                subprocess.run([sys.executable, os.path.join(SRC, 'metric.py'), 'strict'], stdin=inp,
+                               env=dict(os.environ, PYTHONPATH=SRC), stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, check=True)
+            best = min(best, time.perf_counter() - start)
+        return best * 1000
+    finally:
+        os.remove(f.name)
+
+
+def main(scale=1.0):
+    failed = False
+    print('%-14s %10s %10s  %s' % ('module', 'ms', 'budget', 'heavy imports'))
+    for module, (budget, allowed) in BUDGETS.items():
+        millis, packages = import_times(module)
+        heavy = (packages & HEAVY) - allowed - {module}
+        over = millis > budget * scale or heavy
+        failed |= bool(over)
+        print('%-14s %10.1f %10.1f  %s %s' % (module, millis, budget * scale, ','.join(sorted(heavy)) or '-',
+                                             'FAIL' if over else ''))
+    millis = e2e_time()
+    over = millis > E2E_BUDGET * scale
+    failed |= over
+    print('%-14s %10.1f %10.1f  %s' % ('metric strict', millis, E2E_BUDGET * scale, 'FAIL' if over else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument('-scale', type=float, default=1.0, help='Multiplier for the budgets')
+    sys.exit(main(p.parse_args().scale))
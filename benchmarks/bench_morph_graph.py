@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Trie traversals and MorphGraph construction: before and after the queue / node identity changes.
+ - reference: list.pop(0) traversals, and nodes hashed and compared by their path (rebuilt on every call)
+ - trie     : deque traversals, nodes hashed by identity and paths cached
+ - dawg     : MorphGraph built as a minimal DAWG
+
+Usage:
+    $ python benchmarks/bench_morph_graph.py -n 50000
+"""
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import logging
+from ds import Trie, MorphGraph
+
+
+class ReferenceTrie(Trie):
+    """The previous implementation of traversals, hashing and paths"""
+
+    def get_path(self):
+        txt = ''
+        n = self
+        while n:
+            txt = n.name + txt
+            n = n.parent
+        return txt
+
+    def bfs_nodes(self):
+        que = [self]
+        while que:
+            node = que.pop(0)
+            yield node
+            que.extend(node.kids.values())
+
+    def bfs_edges(self):
+        que = [(None, self)]
+        while que:
+            par, kid = que.pop(0)
+            if par is not None:
+                yield (par, kid)
+            que.extend(map(lambda x: (kid, x), kid.kids.values()))
+
+    def __hash__(self):
+        return hash(self.get_path())
+
+    def __eq__(self, other):
+        return isinstance(other, Trie) and self.get_path() == other.get_path()
+
+
+def trie_morph_graph(words, trie_cls):
+    """
+    The previous MorphGraph construction: maps the nodes of prefix and suffix tries to the nodes of merged graph.
+    Trie nodes are the dict keys here, so it is dominated by hashing of the nodes.
+    :return: number of nodes, edges
+    """
+    prf_trie = trie_cls.build(words)
+    suf_trie = trie_cls.build(w[::-1] for w in words)
+    prf_map, suf_map = {}, {}
+    edges = set()
+    for w in words:
+        prf_path, _ = prf_trie.path(w)
+        suf_path, _ = suf_trie.path(w[::-1])
+        prev = '^'
+        for pn, sn, ch in zip(prf_path, suf_path[::-1], w):
+            if pn in prf_map:
+                cur = prf_map[pn]
+                suf_map.setdefault(sn, cur)
+            elif sn in suf_map:
+                cur = prf_map[pn] = suf_map[sn]
+            else:
+                cur = prf_map[pn] = suf_map[sn] = pn.get_path()
+            edges.add((prev, cur))
+            prev = cur
+        edges.add((prev, '$'))
+    return len(set(prf_map.values())), len(edges)
+
+
+def synthetic_words(n, seed=42):
+    """Words made of a few stems and affixes, so they share prefixes and suffixes"""
+    rnd = random.Random(seed)
+    alphabet = 'abcdefghijklmnop'
+    stems = [''.join(rnd.choices(alphabet, k=rnd.randint(3, 8))) for _ in range(n // 10 + 1)]
+    affixes = [''.join(rnd.choices(alphabet, k=rnd.randint(1, 3))) for _ in range(50)]
+    words = set()
+    while len(words) < n:
+        words.add(rnd.choice(affixes[:10]) * (rnd.random() < 0.3) + rnd.choice(stems)
+                  + ''.join(rnd.sample(affixes, rnd.randint(0, 3))))
+    return sorted(words)
+
+
+def timeit(func, repeat=3):
+    """Best of `repeat` runs, with garbage collector disabled"""
+    best = float('inf')
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            res = func()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return res, best
+
+
+def main(n):
+    logging.disable(logging.INFO)
+    words = synthetic_words(n)
+    ref_trie, new_trie = ReferenceTrie.build(words), Trie.build(words)
+    print('Words: %d  Trie nodes: %d' % (len(words), sum(1 for _ in new_trie.bfs_nodes())))
+    cases = [('bfs_nodes', lambda t: lambda: sum(1 for _ in t.bfs_nodes())),
+             ('bfs_edges', lambda t: lambda: sum(1 for _ in t.bfs_edges())),
+             ('node set', lambda t: lambda: len(set(t.bfs_nodes())))]
+    for name, case in cases:
+        ref_res, ref_time = timeit(case(ref_trie))
+        new_res, new_time = timeit(case(new_trie))
+        assert ref_res == new_res, 'Outputs differ'
+        print('%-12s reference: %8.3fs   trie: %8.3fs  (%.1fx)' % (name, ref_time, new_time, ref_time / new_time))
+
+    ref_res, ref_time = timeit(lambda: trie_morph_graph(words, ReferenceTrie), repeat=1)
+    new_res, new_time = timeit(lambda: trie_morph_graph(words, Trie), repeat=1)
+    assert ref_res == new_res, 'Outputs differ'
+    graph, dawg_time = timeit(lambda: MorphGraph(words), repeat=1)
+    print('MorphGraph   reference: %8.3fs   trie: %8.3fs  (%.1fx)   %d nodes, %d edges'
+          % (ref_time, new_time, ref_time / new_time, *ref_res))
+    print('MorphGraph   dawg     : %8.3fs  (%.1fx)   %d nodes, %d edges'
+          % (dawg_time, ref_time / dawg_time, len(graph.get_nodes()), graph.num_edges()))
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', type=int, default=50000, help='Number of words')
+    main(p.parse_args().n)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Oromo stemmer : line level regex vs. token level suffix trie with memoization, on a Zipfian corpus.
+
+Usage:
+    $ python benchmarks/bench_oromo_stemmer.py -n 100000
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from other import oromo_stemmer as stemmer
+
+
+def zipf_corpus(n, vocab_size=50000, zipf_s=1.1, seed=42):
+    """Lines of tokens drawn from a Zipfian distribution, half of the types end with a known suffix"""
+    rnd = random.Random(seed)
+    suffixes = stemmer.ulf_suffixes2 + stemmer.tg_suffixes
+    vocab = []
+    for i in range(vocab_size):
+        word = ''.join(rnd.choice('abcdefghijklmnoprstuw') for _ in range(rnd.randint(2, 8)))
+        if rnd.random() < 0.5:
+            word += rnd.choice(suffixes)
+        vocab.append(word)
+    weights = [1.0 / (rank ** zipf_s) for rank in range(1, vocab_size + 1)]
+    for _ in range(n):
+        yield ' '.join(rnd.choices(vocab, weights=weights, k=rnd.randint(5, 30)))
+
+
+def main(n):
+    lines = list(zipf_corpus(n))
+    n_toks = sum(len(line.split()) for line in lines)
+    print('Lines: %d  Tokens: %d' % (len(lines), n_toks))
+    for name, ptrn in stemmer.patterns.items():
+        for trim in (False, True):
+            rplmt = stemmer.trim_pttrn if trim else stemmer.split_pttrn
+            stm = stemmer.stemmers[name]
+            stm._split.cache_clear(), stm._trim.cache_clear()
+            start = time.perf_counter()
+            expected = [stemmer.oromo_stem_line(line, ptrn, rplmt) for line in lines]
+            regex_time = time.perf_counter() - start
+            start = time.perf_counter()
+            got = [stm.stem_line(line, trim) for line in lines]
+            trie_time = time.perf_counter() - start
+            assert expected == got, 'Outputs differ for %s trim=%s' % (name, trim)
+            print('%-5s trim=%-5s  regex: %9.0f tok/s   trie+cache: %9.0f tok/s  (%.1fx)'
+                  % (name, trim, n_toks / regex_time, n_toks / trie_time, regex_time / trie_time))
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', type=int, default=100000, help='Number of lines')
+    main(p.parse_args().n)
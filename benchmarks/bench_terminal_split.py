@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Throughput of TerminalSplitter.split : decision table vs. the token-by-token exception lookup,
+and of TerminalSplitter.split_all (tokenize and split raw lines) vs. the previous tokenize and split.
+
+Usage:
+    $ python benchmarks/bench_terminal_split.py -n 20000
+"""
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from seqsplit.terminal_rule import TerminalSplitter
+
+
+def reference_tokenize(model, seq):
+    """The previous implementation of TerminalSplitter.tokenize"""
+    toks = seq.split()
+    res = []
+    last = None
+    for tok in toks:
+        if last is None:
+            last = tok
+        else:
+            if tok in model.closures and last in model.terminals:
+                res.append('%s%s' % (last, tok))
+                last = None
+            else:
+                res.append(last)
+                last = tok
+    if last is not None:
+        res.append(last)
+    seq, res = res, []
+    for tok in seq:
+        if tok in model.terminals:
+            res.append(tok)
+        else:
+            if tok[-1] in model.terminals:
+                res.extend([tok[:-1], tok[-1]])
+            elif tok[-2:] in model.terminals:
+                res.extend([tok[:-2], tok[-2]])
+            else:
+                res.append(tok)
+    return res
+
+
+def reference_split(model, long_seq):
+    """The previous implementation of TerminalSplitter.split (with the undefined `seq` fixed)"""
+    if not long_seq:
+        return long_seq
+    res = []
+    left = 0
+    for idx in range(1, len(long_seq)):
+        if long_seq[idx] in model.terminals:
+            do_split = True
+            marker = model.terminals[long_seq[idx]]
+            for rel_ctx_idx, exepts in marker.exceptions.items():
+                tru_ctx_idx = rel_ctx_idx + idx
+                if 0 <= tru_ctx_idx < len(long_seq):
+                    tok = long_seq[tru_ctx_idx]
+                    if model.nocase:
+                        tok = tok.lower()
+                    if exepts.get(tok, 0) > 0:
+                        do_split = False
+            if do_split:
+                res.append(long_seq[left: idx + 1])
+                left = idx + 1
+    if left < len(long_seq):
+        res.append(long_seq[left:])
+    return res
+
+
+def synthetic_lines(n, seed=42):
+    """Sentences with abbreviations (false positive terminals) in them"""
+    rnd = random.Random(seed)
+    words = ['w%d' % i for i in range(5000)]
+    abbrs = ['Dr', 'Mr', 'Mrs', 'St', 'No', 'Prof', 'Inc', 'Jr']
+    terms = ['.', '.', '.', '?', '!', '...']
+    for _ in range(n):
+        toks = []
+        for _ in range(rnd.randint(1, 4)):      # a few sentences per line
+            sent = rnd.sample(words, rnd.randint(4, 25))
+            if rnd.random() < 0.4:
+                sent.insert(rnd.randrange(len(sent)), '%s .' % rnd.choice(abbrs))
+            toks.append(' '.join(sent) + ' ' + rnd.choice(terms))
+        yield ' '.join(toks)
+
+
+def timeit(func, items, repeat=5):
+    """Best of `repeat` runs, with garbage collector disabled"""
+    best = float('inf')
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            res = func(items)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return res, best
+
+
+def main(n):
+    lines = list(synthetic_lines(n))
+    model = TerminalSplitter(min_observations=2, nocase=True)
+    model.learn_from(lines[: n // 2])
+    seqs = [model.tokenize(line) for line in lines]
+    assert seqs == [reference_tokenize(model, line) for line in lines], 'Tokens differ'
+    n_toks = sum(map(len, seqs))
+    print('Lines: %d  Tokens: %d' % (len(seqs), n_toks))
+
+    ref_res, ref_time = timeit(lambda items: [reference_split(model, seq) for seq in items], seqs)
+    new_res, new_time = timeit(lambda items: [model.split(seq) for seq in items], seqs)
+    assert ref_res == new_res, 'Outputs differ'
+    print('split      reference : %10.0f tokens/sec' % (n_toks / ref_time))
+    print('split      compiled  : %10.0f tokens/sec  (%.2fx)' % (n_toks / new_time, ref_time / new_time))
+
+    ref_res, ref_time = timeit(lambda items: [reference_split(model, reference_tokenize(model, line))
+                                              for line in items], lines)
+    new_res, new_time = timeit(model.split_all, lines)
+    assert ref_res == new_res, 'Outputs differ'
+    print('split_all  reference : %10.0f tokens/sec' % (n_toks / ref_time))
+    print('split_all  batched   : %10.0f tokens/sec  (%.2fx)' % (n_toks / new_time, ref_time / new_time))
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', type=int, default=20000, help='Number of lines')
+    main(p.parse_args().n)
@@ -0,0 +1,152 @@
+"""
+Deterministic synthetic fixtures for the benchmarks.
+The same seed and scale produce byte identical files, so the timings from different revisions are comparable.
+
+Usage:
+    $ python benchmarks/fixtures.py -dir /tmp/mtbox-fixtures -scale 1.0
+"""
+import json
+import os
+import random
+from itertools import accumulate
+from xml.sax.saxutils import escape
+
+__version__ = '0.1'
+
+ALPHABET = 'abcdeefghiijklmnoopqrstuuvwxyz'
+FORMAT_VERSION = 1      # bump when the fixtures change, so that the cached fixtures are regenerated
+
+
+def make_words(rnd, n, min_len=2, max_len=12):
+    """
+    Words made of stems and suffixes, so the words share the prefixes like in an inflected language
+    :return: sorted list of unique words
+    """
+    stems = [''.join(rnd.choices(ALPHABET, k=rnd.randint(min_len, max_len - 3))) for _ in range(n // 4 + 1)]
+    suffixes = [''] * 5 + [''.join(rnd.choices(ALPHABET, k=rnd.randint(1, 3))) for _ in range(30)]
+    words = set()
+    while len(words) < n:
+        words.add(rnd.choice(stems) + rnd.choice(suffixes))
+    return sorted(words)
+
+
+def zipf_sampler(rnd, words, s=1.1):
+    """
+    :return: function to sample k words as per Zipf's law
+    """
+    cum_weights = list(accumulate(1.0 / (rank ** s) for rank in range(1, len(words) + 1)))
+    order = words[:]
+    rnd.shuffle(order)
+    return lambda k: rnd.choices(order, cum_weights=cum_weights, k=k)
+
+
+def make_giza_dir(path, rnd, src_words, tgt_words, cands=8):
+    """
+    GIZA++ output directory: vocabularies and the normal and inverse t-tables
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, words in [('src', src_words), ('tgt', tgt_words)]:
+        with open(os.path.join(path, 'corpus.%s.vcb' % name), 'w') as out:
+            for i, word in enumerate(words, start=2):
+                out.write('%d %s %d\n' % (i, word, rnd.randint(1, 1000)))
+    for name, n1, n2 in [('normal', len(src_words), len(tgt_words)), ('invers', len(tgt_words), len(src_words))]:
+        with open(os.path.join(path, 'corpus.%s.t3.final' % name), 'w') as out:
+            for i in range(2, n1 + 2):
+                for j in rnd.sample(range(2, n2 + 2), cands):
+                    out.write('%d %d %.6g\n' % (i, j, rnd.random()))
+
+
+def make_glove(path, rnd, words, dim=50):
+    with open(path, 'w') as out:
+        for word in words:
+            out.write(word)
+            out.write(''.join(' %.5f' % rnd.gauss(0, 0.5) for _ in range(dim)))
+            out.write('\n')
+
+
+def make_parallel(prefix, rnd, src_sample, tgt_sample, n):
+    """
+    Parallel corpus <prefix>.src and <prefix>.tgt. The source lines have a few sentences each, with abbreviations
+    """
+    abbrs = ['Dr .', 'Mr .', 'St .', 'No .', 'Prof .']
+    terms = ['.', '.', '.', '?', '!', '...']
+    with open(prefix + '.src', 'w') as src, open(prefix + '.tgt', 'w') as tgt:
+        for _ in range(n):
+            sents = []
+            for _ in range(rnd.randint(1, 3)):
+                sent = src_sample(rnd.randint(4, 20))
+                if rnd.random() < 0.3:
+                    sent.insert(rnd.randrange(len(sent)), rnd.choice(abbrs))
+                sents.append(' '.join(sent) + ' ' + rnd.choice(terms))
+            src.write(' '.join(sents) + '\n')
+            tgt.write(' '.join(tgt_sample(rnd.randint(4, 30))) + '\n')
+
+
+def make_elisa(path, rnd, src_sample, tgt_sample, n):
+    """
+    ELISA package XML, having only the elements read by elisa.parse_elisa
+    """
+    tags = ['translation'] * 6 + ['identity', 'unknown']
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n<ELISA_LRLP_CORPUS>\n<DOCUMENT id="doc1">\n')
+        for i in range(n):
+            src = escape(' '.join(src_sample(rnd.randint(4, 25))))
+            tokens = ''.join('<TOKEN rule-class="%s">%s</TOKEN>' % (rnd.choice(tags), escape(tok))
+                             for tok in tgt_sample(rnd.randint(4, 25)))
+            out.write('<SEGMENT><SOURCE id="src.%d"><ULF_LRLP_TOKENIZED_SOURCE>%s</ULF_LRLP_TOKENIZED_SOURCE>'
+                      '</SOURCE><TARGET id="tgt.%d"><TOKENIZED_TARGET>%s</TOKENIZED_TARGET></TARGET></SEGMENT>\n'
+                      % (i, src, i, tokens))
+        out.write('</DOCUMENT>\n</ELISA_LRLP_CORPUS>\n')
+
+
+def make_names(path, rnd, n):
+    """Person and place names, some with the repeated letters as in Oromo"""
+    parts = [''.join(rnd.choices(ALPHABET, k=rnd.randint(2, 5))) for _ in range(300)]
+    with open(path, 'w') as out:
+        for _ in range(n):
+            name = ' '.join(''.join(rnd.sample(parts, rnd.randint(1, 3))).title() for _ in range(rnd.randint(1, 3)))
+            out.write(name + '\n')
+
+
+def make_fixtures(path, scale=1.0, seed=42):
+    """
+    Creates all the fixtures in a directory, unless they are already created with the same args
+    :param path: directory
+    :param scale: multiplier for the sizes
+    :param seed: random seed
+    :return: dict of fixture name -> path
+    """
+    paths = {'giza': 'giza', 'ttab': 'ttab.pkl', 'glove': 'glove.txt', 'parallel': 'corpus', 'elisa': 'elisa.xml',
+             'names': 'names.txt'}
+    paths = {name: os.path.join(path, p) for name, p in paths.items()}
+    meta = {'scale': scale, 'seed': seed, 'format_version': FORMAT_VERSION}
+    meta_path = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return paths
+    os.makedirs(path, exist_ok=True)
+    size = lambda n: max(10, int(n * scale))
+    rnd = random.Random(seed)
+    src_words = make_words(rnd, size(20000))
+    tgt_words = make_words(rnd, size(15000))
+    src_sample, tgt_sample = zipf_sampler(rnd, src_words), zipf_sampler(rnd, tgt_words)
+    make_giza_dir(paths['giza'], rnd, src_words, tgt_words)
+    make_glove(paths['glove'], rnd, tgt_words)
+    make_parallel(paths['parallel'], rnd, src_sample, tgt_sample, size(20000))
+    make_elisa(paths['elisa'], rnd, src_sample, tgt_sample, size(10000))
+    make_names(paths['names'], rnd, size(20000))
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return paths
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser(description='Creates the benchmark fixtures')
+    p.add_argument('-dir', required=True, help='Directory to create fixtures')
+    p.add_argument('-scale', type=float, default=1.0, help='Multiplier for the sizes of fixtures')
+    p.add_argument('-seed', type=int, default=42, help='Random seed')
+    args = vars(p.parse_args())
+    for name, path in make_fixtures(args['dir'], args['scale'], args['seed']).items():
+        print('%s\t%s' % (name, path))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for the hot paths in src/.
+Each case runs in a fresh process on the fixtures (see fixtures.py), so that its peak RSS is its own.
+Results are written as JSON having the throughput and peak RSS of each case; two result files can be compared.
+
+Usage:
+    $ python benchmarks/suite.py -out before.json
+    $ git checkout <other revision>
+    $ python benchmarks/suite.py -out after.json -compare before.json
+    $ python benchmarks/suite.py -cases trie elisa     # only the cases having these words in their names
+"""
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from itertools import islice
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+sys.path.insert(0, SRC)
+sys.path.insert(0, HERE)
+from fixtures import make_fixtures
+
+__version__ = '0.1'
+
+CASES = OrderedDict()       # name -> (setup, unit)
+
+
+def case(name, unit):
+    """
+    Registers a benchmark case. The decorated function takes the fixture paths, does the setup (not timed),
+    and returns a function which runs the hot path and returns the number of items it processed.
+    """
+    def register(setup):
+        CASES[name] = (setup, unit)
+        return setup
+    return register
+
+
+def read_lines(path, limit=None):
+    with open(path) as f:
+        return [line.rstrip('\n') for line in islice(f, limit)]
+
+
+def read_tokens(path, limit=None):
+    return [tok for line in read_lines(path, limit) for tok in line.split()]
+
+
+def read_vocab(giza_dir, side='src'):
+    with open(os.path.join(giza_dir, 'corpus.%s.vcb' % side)) as f:
+        return [line.split()[1] for line in f]
+
+
+def entries(ttab):
+    return sum(map(len, ttab.ttab.values())) + sum(map(len, ttab.inv_ttab.values()))
+
+
+@case('ttab.build', 'entries')
+def ttab_build(fx):
+    from giza import TTable
+    return lambda: entries(TTable(fx['giza'], 'src', 'tgt'))
+
+
+@case('ttab.load', 'entries')
+def ttab_load(fx):
+    from giza import TTable
+    TTable(fx['giza'], 'src', 'tgt').store_at(fx['ttab'])     # pickled by the code under test
+    return lambda: entries(TTable.load_from(fx['ttab']))
+
+
+@case('trie.build', 'words')
+def trie_build(fx):
+    from ds import Trie
+    words = read_vocab(fx['giza'])
+    return lambda: len(Trie.build(words))
+
+
+@case('trie.prefix_match', 'tokens')
+def trie_match(fx):
+    from ds import Trie
+    trie = Trie.build(read_vocab(fx['giza']))
+    # tokens with a few extra chars, as in the OOV words
+    tokens = [tok + 'ni' for tok in read_tokens(fx['parallel'] + '.src', 10000)]
+
+    def run():
+        for tok in tokens:
+            trie.prefix_match(tok)
+        return len(tokens)
+    return run
+
+
+def oov_words(fx, n=2000):
+    rnd = random.Random(1)
+    vocab = read_vocab(fx['giza'])
+    n = min(n, len(vocab))      # small vocab at small scales
+    return [word[:-1] + rnd.choice('aeiou') + 'ni' for word in rnd.sample(vocab, n)]
+
+
+@case('oov.translate', 'words')
+def oov_translate(fx):
+    from giza import TTable
+    from oov import SuffixTranslator
+    from nltk.corpus import wordnet
+    wordnet.ensure_loaded()
+    trans = SuffixTranslator(TTable(fx['giza'], 'src', 'tgt'))
+    words = oov_words(fx, 200)
+
+    def run():
+        for word in words:
+            trans.translate(word)
+        return len(words)
+    return run
+
+
+@case('oov.prefix_match', 'words')
+def oov_prefix_match(fx):
+    """SuffixTranslator without synonym clustering, which needs wordnet"""
+    from giza import TTable
+    from oov import SuffixTranslator
+    trans = SuffixTranslator(TTable(fx['giza'], 'src', 'tgt'))
+    words = oov_words(fx)
+
+    def run():
+        for word in words:
+            trans.prefix_match(word, cluster=False)
+        return len(words)
+    return run
+
+
+@case('edit_distance.lavenshtein_matrix', 'pairs')
+def lavenshtein(fx):
+    from edit_distance import lavenshtein_matrix
+    rnd = random.Random(1)
+    words = read_vocab(fx['giza'])
+    pairs = [(rnd.choice(words), rnd.choice(words)) for _ in range(2000)]
+
+    def run():
+        for w1, w2 in pairs:
+            lavenshtein_matrix(w1, w2)
+        return len(pairs)
+    return run
+
+
+@case('metric.glove.load', 'vectors')
+def glove_load(fx):
+    from metric import GloveCosine
+    import scipy.spatial.distance    # GloveCosine imports it lazily; imported here so that its absence is a skip
+    return lambda: len(GloveCosine(fx['glove']).gloves)
+
+
+@case('metric.glove.score', 'pairs')
+def glove_score(fx):
+    from metric import GloveCosine
+    metric = GloveCosine(fx['glove'])
+    tokens = read_tokens(fx['parallel'] + '.tgt', 5000)
+    pairs = list(zip(tokens[:50000], tokens[1:50001]))
+
+    def run():
+        for w1, w2 in pairs:
+            metric(w1, w2)
+        return len(pairs)
+    return run
+
+
+@case('ngram_match.match', 'lines')
+def ngram_match(fx):
+    from ngram_match import match
+    hyps = [line.split() for line in read_lines(fx['parallel'] + '.tgt')]
+    refs = hyps[1:] + hyps[:1]
+
+    def run():
+        for hyp, ref in zip(hyps, refs):
+            match(hyp, ref)
+        return len(hyps)
+    return run
+
+
+@case('terminal_rule.learn', 'lines')
+def terminal_learn(fx):
+    from seqsplit.terminal_rule import TerminalSplitter
+    lines = read_lines(fx['parallel'] + '.src')
+
+    def run():
+        TerminalSplitter(min_observations=2).learn_from(lines)
+        return len(lines)
+    return run
+
+
+@case('terminal_rule.split', 'lines')
+def terminal_split(fx):
+    from seqsplit.terminal_rule import TerminalSplitter
+    lines = read_lines(fx['parallel'] + '.src')
+    model = TerminalSplitter(min_observations=2)
+    model.learn_from(lines)
+    seqs = [model.tokenize(line) for line in lines]
+
+    def run():
+        for seq in seqs:
+            model.split(seq)
+        return len(seqs)
+    return run
+
+
+@case('elisa.parse_elisa', 'segments')
+def elisa_parse(fx):
+    from elisa import parse_elisa
+    return lambda: sum(1 for _ in parse_elisa(fx['elisa']))
+
+
+@case('oromo_norm.normalize_word', 'tokens')
+def normalize_word(fx):
+    from other.oromo_norm import normalize_word
+    tokens = read_tokens(fx['names']) + read_tokens(fx['parallel'] + '.src', 10000)
+
+    def run():
+        normalize_word.cache_clear()    # the cache would make the repeated runs faster than the first
+        for tok in tokens:
+            normalize_word(tok)
+        return len(tokens)
+    return run
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / (1 << 10)     # bytes on mac, KB on linux
+
+
+def run_case(name, fixtures, repeat=3):
+    """
+    Runs a case in this process
+    :return: dict of results
+    """
+    setup, unit = CASES[name]
+    res = {'case': name, 'unit': unit}
+    try:
+        func = setup(fixtures)
+    except ImportError as e:
+        res['skipped'] = 'ImportError: %s' % e
+        return res
+    res['setup_rss_mb'] = round(peak_rss_mb(), 1)
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            items = func()
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    best = min(times)
+    res.update(items=items, seconds=round(best, 4), mean_seconds=round(sum(times) / len(times), 4),
+               throughput=round(items / best, 1), peak_rss_mb=round(peak_rss_mb(), 1))
+    return res
+
+
+def run_isolated(name, fixture_dir, scale, repeat):
+    """Runs a case in a new process and returns its results"""
+    cmd = [sys.executable, os.path.abspath(__file__), '-fixtures', fixture_dir, '-scale', str(scale),
+           '-repeat', str(repeat), '-run-case', name]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        return {'case': name, 'error': proc.stderr.strip().split('\n')[-1]}
+    return json.loads(proc.stdout.strip().split('\n')[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    """Prints the ratio of throughput to that of baseline"""
+    old = {r['case']: r for r in baseline['results']}
+    print('%-34s %14s %14s %8s %10s' % ('case', 'before/sec', 'after/sec', 'speedup', 'rss MB'))
+    for res in results['results']:
+        prev = old.get(res['case'], {})
+        if 'throughput' not in res or 'throughput' not in prev:
+            print('%-34s %s' % (res['case'], res.get('skipped') or res.get('error') or 'new case'))
+            continue
+        print('%-34s %14.1f %14.1f %7.2fx %4.0f->%-4.0f' % (res['case'], prev['throughput'], res['throughput'],
+                                                           res['throughput'] / prev['throughput'],
+                                                           prev['peak_rss_mb'], res['peak_rss_mb']))
+
+
+def main(cases, fixture_dir, scale, repeat, out, baseline):
+    names = [name for name in CASES if not cases or any(c in name for c in cases)]
+    fixture_dir = fixture_dir or os.path.join(tempfile.gettempdir(), 'mtbox-bench-fixtures')
+    make_fixtures(fixture_dir, scale)
+    results = {'meta': {'revision': git_revision(), 'python': platform.python_version(),
+                        'platform': platform.platform(), 'scale': scale, 'repeat': repeat,
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'results': []}
+    for name in names:
+        res = run_isolated(name, fixture_dir, scale, repeat)
+        results['results'].append(res)
+        print('%-34s %s' % (name, ', '.join('%s=%s' % (k, v) for k, v in res.items() if k != 'case')),
+              file=sys.stderr)
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if baseline:
+        with open(baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser(description='Benchmarks of the hot paths',
+                                formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('-cases', nargs='*', help='Run only the cases having any of these in their names. Cases: %s'
+                                             % ', '.join(CASES))
+    p.add_argument('-fixtures', help='Directory for the fixtures, they are created when missing. '
+                                     'Default is a directory in the system temp')
+    p.add_argument('-scale', type=float, default=1.0, help='Multiplier for the sizes of fixtures')
+    p.add_argument('-repeat', type=int, default=3, help='Number of runs of each case; best one is reported')
+    p.add_argument('-out', help='Write the results JSON to this file. Default is STDOUT')
+    p.add_argument('-compare', help='Results JSON of an earlier run to compare with')
+    p.add_argument('-run-case', help=argparse.SUPPRESS)     # internal: runs one case in this process
+    args = vars(p.parse_args())
+    if args['run_case']:
+        import logging
+        logging.disable(logging.WARNING)
+        fixtures = make_fixtures(args['fixtures'], args['scale'])
+        print(json.dumps(run_case(args['run_case'], fixtures, args['repeat'])))
+    else:
+        main(args['cases'], args['fixtures'], args['scale'], args['repeat'], args['out'], args['compare'])
@@ -11,7 +11,6 @@ import logging as log
 from collections import defaultdict
 import numpy as np
 import pickle
-import random
 
 
 log.basicConfig(level=log.INFO)
@@ -30,53 +29,105 @@ class Joiner(object):
         8. Modify both (remove both and insert)
     """
 
-    def __init__(self, types={1}):
+    # which side(s) are cut, and how many chars are inserted at the join
+    CUT_LEFT = {3, 5, 6, 8}
+    CUT_RIGHT = {4, 5, 7, 8}
+    ALL_TYPES = set(range(1, 9))
+
+    def __init__(self, types={1}, alphabet=string.ascii_lowercase, max_edit=2, rng=None):
+        """
+        :param types: supported types of operations
+        :param alphabet: chars to insert at the join
+        :param max_edit: maximum number of chars removed or inserted at each side
+        :param rng: numpy random Generator
+        """
+        assert types and set(types) <= self.ALL_TYPES, f'types should be from {self.ALL_TYPES}'
         self.types = types      # Supported types
+        self.alphabet = alphabet
+        self.max_edit = max_edit
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    @staticmethod
+    def edit(l, r, cut_l=0, cut_r=0, ins=''):
+        """
+        All the operations are of this form: cut some chars on either sides and insert some chars in between.
+        A side is never cut completely, at least one char of it remains.
+        """
+        if cut_l:
+            l = l[:max(1, len(l) - cut_l)]
+        if cut_r:
+            r = r[min(cut_r, len(r) - 1):]
+        return l + ins + r
 
     def type1(self, l, r):
         """Simple concatenation"""
         return l + r
 
-    def type2(self, l, r):
+    def type2(self, l, r, ins):
         """Add some chars"""
-        raise Exception('Not implemented')
+        return self.edit(l, r, ins=ins)
 
-    def type3(self, l, r):
+    def type3(self, l, r, cut):
         """Remove some chars on left side"""
-        raise Exception('Not implemented')
+        return self.edit(l, r, cut_l=cut)
 
-    def type4(self, l, r):
+    def type4(self, l, r, cut):
         """Remove some chars on right side"""
-        raise Exception('Not implemented')
+        return self.edit(l, r, cut_r=cut)
 
-    def type5(self, l, r):
+    def type5(self, l, r, cut_l, cut_r):
         """Remove some chars on both side"""
-        raise Exception('Not implemented')
+        return self.edit(l, r, cut_l=cut_l, cut_r=cut_r)
 
-    def type6(self, l, r):
+    def type6(self, l, r, ins):
         """Modify some chars on left side"""
-        raise Exception('Not implemented')
+        return self.edit(l, r, cut_l=len(ins), ins=ins)
 
-    def type7(self, l, r):
+    def type7(self, l, r, ins):
         """Modify some chars on right side"""
-        raise Exception('Not implemented')
+        return self.edit(l, r, cut_r=len(ins), ins=ins)
 
-    def type8(self, l, r):
+    def type8(self, l, r, cut_l, cut_r, ins):
         """Modify some chars on both side"""
-        raise Exception('Not implemented')
-
-    def join(self, l, r):
-        # TODO: support other types of joins
-        return self.type1(l, r), 1
+        return self.edit(l, r, cut_l=cut_l, cut_r=cut_r, ins=ins)
+
+    def table(self, size):
+        """
+        Draws a batch of random operations with their parameters
+        :param size: number of operations
+        :return: list of (type, cut_l, cut_r, ins)
+        """
+        rng = self.rng
+        types = rng.choice(sorted(self.types), size=size)
+        n_left, n_right = rng.integers(1, self.max_edit + 1, size=(2, size))
+        cut_l = np.where(np.isin(types, list(self.CUT_LEFT)), n_left, 0)
+        cut_r = np.where(np.isin(types, list(self.CUT_RIGHT)), n_right, 0)
+        # modifications replace the cut chars, type 2 and 8 insert any number of chars
+        ins_len = np.select([types == 2, types == 6, types == 7, types == 8], [n_left, cut_l, cut_r, n_right], 0)
+        chars = np.array(list(self.alphabet))[rng.integers(0, len(self.alphabet), size=(size, self.max_edit))]
+        ins = [''.join(row[:n]) for row, n in zip(chars.tolist(), ins_len.tolist())]
+        return list(zip(types.tolist(), cut_l.tolist(), cut_r.tolist(), ins))
+
+    def join(self, l, r, op=None):
+        """
+        :param l: left morpheme
+        :param r: right morpheme
+        :param op: (type, cut_l, cut_r, ins) from table(); a random operation is drawn when not given
+        :return: compound, type
+        """
+        morph_type, cut_l, cut_r, ins = op or self.table(1)[0]
+        return self.edit(l, r, cut_l, cut_r, ins), morph_type
 
 
 class SyntheticLang(object):
     """a synthetic language generator with morphologically inflected vocabulary."""
 
-    def __init__(self, alphabet_size=15, num_morphs=1000, min_morph_len=2, max_morph_len=8, num_words=3000):
+    def __init__(self, alphabet_size=15, num_morphs=1000, min_morph_len=2, max_morph_len=8, num_words=3000,
+                 seed=None, batch_size=10000, join_types={1}):
         assert num_morphs > 0
         assert num_words > num_morphs
         assert alphabet_size <= len(string.ascii_letters)
+        assert max_morph_len <= alphabet_size   # chars of a morpheme are drawn without replacement
 
         self.alphabet_size = alphabet_size
         self.alphabet = list(string.ascii_letters[:alphabet_size])
@@ -84,29 +135,44 @@ class SyntheticLang(object):
         self.max_morph_len = max_morph_len
         self.min_morph_len = min_morph_len
         self.num_words = num_words
+        self.seed = seed
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
 
         # using exponential distribution for characters
-        sample = np.random.exponential(scale=1.5, size=alphabet_size)
+        sample = self.rng.exponential(scale=1.5, size=alphabet_size)
         self.char_freq_distr = sample / sum(sample)
 
-        sample = np.random.random(size=max_morph_len+1)
+        sample = self.rng.random(size=max_morph_len+1)
         for i in range(min_morph_len):
             sample[i] = 0   # make zero probability
         self.word_len_distr = sample / sum(sample)
 
         self.morphs = self.generate_morphs(self.num_morphs)
-        self.joiner = Joiner(types={1})         # only type 1 for now
+        self.joiner = Joiner(types=join_types, alphabet=self.alphabet, rng=self.rng)
+        self.num_ambiguous = 0     # compounds formed in more than one way
         self.words = self.generate_words(list(self.morphs.keys()), self.num_words)
 
+    def sample_morphs(self, size):
+        """
+        Samples a batch of morphemes.
+        Characters in a morpheme are drawn without replacement as per char_freq_distr,
+        for all morphemes at once using Gumbel top-k trick: top k of log(p) + Gumbel noise is a weighted sample of k
+        :param size: number of morphemes
+        :return: list of morphemes
+        """
+        lengths = self.rng.choice(len(self.word_len_distr), size=size, p=self.word_len_distr)
+        keys = np.log(self.char_freq_distr) + self.rng.gumbel(size=(size, self.alphabet_size))
+        ranked = np.argsort(-keys, axis=1)[:, :self.max_morph_len]
+        chars = np.array(self.alphabet)[ranked]
+        return [''.join(row[:n]) for row, n in zip(chars.tolist(), lengths.tolist())]
+
     def generate_morphs(self, count):
         res = defaultdict(int)
-        lengths = list(range(self.max_morph_len + 1))
-
         while len(res) < count:
-            morph_len = np.random.choice(lengths, replace=False, p=self.word_len_distr)
-            chars = np.random.choice(self.alphabet, replace=False, p=self.char_freq_distr, size=morph_len)
-            morph = ''.join(chars)
-            res[morph] += 1
+            for morph in self.sample_morphs(min(self.batch_size, 2 * (count - len(res)))):
+                if morph in res or len(res) < count:
+                    res[morph] += 1
         return res
 
     def generate_words(self, morphs, count):
@@ -114,6 +180,7 @@ class SyntheticLang(object):
         words = {}
         word_list = []   # for making a random choice
         fertility = defaultdict(int)
+        edit = self.joiner.edit
         assert type(morphs) is list
 
         # randomly select some morphemes as prefixes or suffixes.
@@ -123,31 +190,55 @@ class SyntheticLang(object):
             words[morph] = ((morph, ''), 0)    # 0 = atomic morpheme
             word_list.append(morph)
 
-        while len(words) < count + num_affix:
-            left = np.random.choice(word_list)
-            right = np.random.choice(word_list)
-            compound, morph_type = self.joiner.join(left, right)
-            if len(compound) > 3 * self.max_morph_len:
-                continue    # too long
-            if compound not in words:
-                words[compound] = ((left, right), morph_type)
-                word_list.append(compound)
-                fertility[left] += 1
-                fertility[right] += 1
-            else:
-                (old_l, old_r), old_type = words[compound]
-                if old_l != left or old_r != right or old_type != morph_type:
-                    # great! now we have ambiguity too
-                    log.warning(f"Ambiguous construct: {compound} = {old_l}+{old_r} (type{old_type}) "
-                                f" = {left}+{right} (type{morph_type}) ")
+        target = count + num_affix
+        while len(words) < target:
+            # uniform random numbers in a batch, scaled to the size of word_list at the time of use
+            picks = self.rng.random(size=(self.batch_size, 2)).tolist()
+            for (u_left, u_right), (morph_type, cut_l, cut_r, ins) in zip(picks, self.joiner.table(self.batch_size)):
+                if len(words) >= target:
+                    break
+                left = word_list[int(u_left * len(word_list))]
+                right = word_list[int(u_right * len(word_list))]
+                compound = edit(left, right, cut_l, cut_r, ins)
+                if len(compound) > 3 * self.max_morph_len:
+                    continue    # too long
+                if compound not in words:
+                    words[compound] = ((left, right), morph_type)
+                    word_list.append(compound)
+                    fertility[left] += 1
+                    fertility[right] += 1
+                else:
+                    (old_l, old_r), old_type = words[compound]
+                    if old_l != left or old_r != right or old_type != morph_type:
+                        # great! now we have ambiguity too
+                        self.num_ambiguous += 1
+        log.info(f"Generated {len(words)} words; {self.num_ambiguous} constructs are ambiguous")
 
         # these wont go to vocab as independent words
         affixes = sorted(fertility.items(), key=lambda x: x[1], reverse=True)[:num_affix * 2]
-        affixes = random.sample(affixes, num_affix)
-        for affix, ft in affixes:
-                del words[affix]
+        self.affixes = {}       # kept aside for segmenting the words built from them
+        for idx in self.rng.choice(len(affixes), size=num_affix, replace=False):
+            affix = affixes[idx][0]
+            self.affixes[affix] = words.pop(affix)
         return words
 
+    def segment(self, word):
+        """
+        Gold segmentation of a word
+        :param word: a word from this language
+        :return: list of morphemes
+        """
+        res, stack = [], [word]
+        while stack:
+            part = stack.pop()
+            (left, right), morph_type = self.words[part] if part in self.words else self.affixes[part]
+            if morph_type == 0:
+                res.append(part)
+            else:
+                stack.append(right)
+                stack.append(left)
+        return res
+
     def save(self, path):
         log.info(f"Writing to {path}")
         with open(path, 'wb') as f:
@@ -159,6 +250,150 @@ class SyntheticLang(object):
                 f.write(f'{w}\t{t}\t{l}\t{r}\n')
 
 
+class AliasTable(object):
+    """
+    Walker's alias table for drawing from a discrete distribution in O(1) per sample
+    """
+
+    def __init__(self, probs):
+        probs = np.asarray(probs, dtype=np.float64)
+        n = len(probs)
+        scaled = probs * (n / probs.sum())
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # left overs are 1.0, except for rounding errors
+
+    def sample(self, rng, size):
+        """
+        :param rng: numpy random Generator
+        :param size: number of samples
+        :return: array of indices
+        """
+        idx = rng.integers(0, len(self.prob), size=size)
+        return np.where(rng.random(size) < self.prob[idx], idx, self.alias[idx])
+
+
+class CorpusGenerator(object):
+    """
+    Generates sentences of a SyntheticLang, with word frequencies following Zipf's law.
+    Each sentence is written along with its gold segmentation.
+    """
+
+    def __init__(self, lang, zipf_s=1.1, min_len=3, max_len=25, morph_sep='+', seed=None):
+        """
+        :param lang: SyntheticLang
+        :param zipf_s: exponent of Zipf's distribution
+        :param min_len: minimum number of words in a sentence
+        :param max_len: maximum number of words in a sentence
+        :param morph_sep: separator for morphemes in gold segmentation
+        :param seed: seed for assigning ranks to words
+        """
+        self.vocab = list(lang.words.keys())
+        self.segs = [morph_sep.join(lang.segment(w)) for w in self.vocab]
+        ranks = np.random.default_rng(seed).permutation(len(self.vocab)) + 1
+        self.table = AliasTable(1.0 / ranks ** zipf_s)
+        self.min_len = min_len
+        self.max_len = max_len
+
+    def sentences(self, num, rng, batch_size=10000):
+        """
+        :param num: number of sentences
+        :param rng: numpy random Generator
+        :param batch_size: number of sentences to generate at once
+        :return: stream of (list of sentences, list of segmented sentences)
+        """
+        while num > 0:
+            size = min(num, batch_size)
+            num -= size
+            lengths = rng.integers(self.min_len, self.max_len + 1, size=size)
+            ids = self.table.sample(rng, int(lengths.sum())).tolist()
+            ends = np.cumsum(lengths).tolist()
+            words = [self.vocab[i] for i in ids]
+            segs = [self.segs[i] for i in ids]
+            starts = [0] + ends[:-1]
+            yield ([' '.join(words[a:b]) for a, b in zip(starts, ends)],
+                   [' '.join(segs[a:b]) for a, b in zip(starts, ends)])
+
+    def write_shard(self, num, prefix, seed):
+        """
+        Writes sentences to <prefix>.txt and gold segmentations to <prefix>.seg
+        :param num: number of sentences
+        :param prefix: output path prefix
+        :param seed: seed or SeedSequence for this shard
+        :return: number of sentences written
+        """
+        rng = np.random.default_rng(seed)
+        with open(prefix + '.txt', 'w', buffering=1 << 20) as txt, open(prefix + '.seg', 'w', buffering=1 << 20) as seg:
+            for sents, segs in self.sentences(num, rng):
+                txt.write('\n'.join(sents))
+                txt.write('\n')
+                seg.write('\n'.join(segs))
+                seg.write('\n')
+        return num
+
+    def write(self, num, prefix, shards=1, workers=1, seed=None):
+        """
+        Writes a corpus in shards <prefix>.<shard>.{txt,seg}. Each shard has its own seed, derived from the seed,
+        so the output is same irrespective of the number of workers
+        :param num: number of sentences
+        :param prefix: output path prefix
+        :param shards: number of shards
+        :param workers: number of worker processes
+        :param seed: seed
+        :return: list of shard prefixes
+        """
+        seeds = np.random.SeedSequence(seed).spawn(shards)
+        sizes = [num // shards + (1 if i < num % shards else 0) for i in range(shards)]
+        jobs = [(size, '%s.%05d' % (prefix, i), shard_seed) for i, (size, shard_seed) in enumerate(zip(sizes, seeds))]
+        if workers > 1:
+            from multiprocessing import Pool
+            with Pool(workers, initializer=_init_generator, initargs=(self,)) as pool:
+                pool.starmap(_write_shard, jobs)
+        else:
+            for job in jobs:
+                self.write_shard(*job)
+        log.info(f"Wrote {num} sentences in {shards} shards to {prefix}.*")
+        return [job[1] for job in jobs]
+
+
+_generator = {}
+
+
+def _init_generator(gen):
+    _generator['gen'] = gen
+
+
+def _write_shard(num, prefix, seed):
+    return _generator['gen'].write_shard(num, prefix, seed)
+
+
 if __name__ == '__main__':
-    lang = SyntheticLang(alphabet_size=15, num_morphs=1000, num_words=3000)
-    lang.write_words('words.txt')
+    import argparse
+    p = argparse.ArgumentParser(description='Synthetic language and corpus generator')
+    p.add_argument('-alphabet', type=int, default=15, help='Alphabet size')
+    p.add_argument('-morphs', type=int, default=1000, help='Number of morphemes')
+    p.add_argument('-words', type=int, default=3000, help='Number of words')
+    p.add_argument('-seed', type=int, default=0, help='Random seed')
+    p.add_argument('-types', type=int, nargs='+', default=[1], choices=range(1, 9),
+                   help='Types of join operations, see Joiner')
+    p.add_argument('-vocab', default='words.txt', help='Path to write the words')
+    p.add_argument('-sents', type=int, default=0, help='Number of sentences to generate; 0 for none')
+    p.add_argument('-corpus', default='corpus', help='Path prefix for the corpus shards')
+    p.add_argument('-shards', type=int, default=1, help='Number of corpus shards')
+    p.add_argument('-workers', type=int, default=1, help='Number of worker processes')
+    p.add_argument('-zipf', type=float, default=1.1, help='Exponent of Zipf distribution of words')
+    args = vars(p.parse_args())
+    lang = SyntheticLang(alphabet_size=args['alphabet'], num_morphs=args['morphs'], num_words=args['words'],
+                         seed=args['seed'], join_types=set(args['types']))
+    lang.write_words(args['vocab'])
+    if args['sents'] > 0:
+        gen = CorpusGenerator(lang, zipf_s=args['zipf'], seed=args['seed'])
+        gen.write(args['sents'], args['corpus'], shards=args['shards'], workers=args['workers'], seed=args['seed'])
@@ -15,83 +15,213 @@ Format:
 """
 
 import logging as log
+import time
+from collections import Counter, deque
+from functools import partial
+from itertools import accumulate, islice
+from multiprocessing import Pool
 log.basicConfig(level=log.INFO)
 
 
-def un_split(seq1, seq2, drop_chars=''):
-    """Finds alignment with whole words and parts (in same order)."""
-    assert len(seq2) >= len(seq1)  # the words in seq1 are split to get seq2, the length of seq2 should be bigger
-    # figure out the split alignments
-    l, r = 0, 0  # left is original seq, right is split sequence
-    splits = []
-    while l < len(seq1) and r < len(seq2):
+def un_split(seq1, seq2, drop_chars='', stats=None, window=5):
+    """
+    Finds alignment with whole words and parts (in same order).
+    The parts are cleaned once, and the parts of a word are found by matching the word boundaries,
+    i.e. the cumulative lengths of words against that of parts, and then the content.
+    When the parts dont join to a word, the alignment is resumed at the nearest word (within the window)
+     whose parts join to it; the words and parts in between are skipped.
+    So it is linear in the length of sequences.
+    :param seq1: original words
+    :param seq2: parts of words
+    :param drop_chars: chars such as '@@' or '-' introduced to parts
+    :param stats: Counter for the number of parts which are not aligned with any word ('bad_parts')
+    :param window: number of words and parts to look ahead for resuming the alignment
+    :return: list of tuple of parts, one per word; None for the words which could not be aligned
+    """
+    parts = [part.strip() for part in seq2]
+    if drop_chars:
+        # any replacements such as @@ or - introduced to splits
+        parts = [part.replace(drop_chars, '') for part in parts]
+    starts = list(accumulate(map(len, parts), initial=0))     # starts[i] is offset of i'th part, the last is end
+    m, n = len(seq1), len(parts)
+
+    def match(l, r):
+        # end of the parts starting at r, which join to the word at l; None when they dont
         word = seq1[l]
-        buf = ""
-        i = r
-        while i < len(seq2):
-            buf += seq2[i].strip()
-            if drop_chars:
-                # any replacements such as @@ or - introduced to splits
-                buf = buf.replace(drop_chars, '')
-            i += 1
-            if buf == word:
-                break
-            elif len(buf) > len(word):   # exceeded len, but didnt get the original word
-                raise Exception(f"Cant find split of word {word}")
-            # else : keep joining splits
-
-        assert word == buf
-        splits.append(tuple(seq2[r: i]))
-        r = i
-        l += 1
-    assert len(seq1) == len(splits)
+        end = starts[r] + len(word)
+        k = r + 1
+        while k < n and starts[k] < end:
+            k += 1
+        if starts[k] == end and (k == r + 1 and parts[r] == word or ''.join(parts[r: k]) == word):
+            return k
+        return None
+
+    def resync(l, r):
+        # nearest (l + dl, r + dr) where the parts join to the word
+        for dist in range(1, 2 * window + 1):
+            for dl in range(max(0, dist - window), min(dist, window) + 1):
+                l2, r2 = l + dl, r + dist - dl
+                if l2 < m and r2 < n and match(l2, r2) is not None:
+                    return l2, r2
+        return None
+
+    splits = []
+    bad_parts = 0
+    l, r = 0, 0  # left is original seq, right is split sequence
+    while l < m:
+        k = match(l, r) if r < n else None
+        if k is not None:
+            splits.append(tuple(seq2[r: k]))
+            l, r = l + 1, k
+            continue
+        nxt = resync(l, r)
+        if nxt is None:
+            # nothing to resume with nearby; skip this word and try the next one with the same parts
+            log.debug(f"Cant find split of word {seq1[l]}")
+            splits.append(None)
+            l += 1
+            continue
+        l2, r2 = nxt
+        log.debug(f"Cant find split of words {seq1[l: l2]}, skipping parts {seq2[r: r2]}")
+        splits.extend([None] * (l2 - l))
+        bad_parts += r2 - r
+        l, r = l2, r2
+    bad_parts += n - r      # left over parts
+    if bad_parts:
+        if stats is None:
+            log.debug(f"{bad_parts} parts are not aligned with any word")
+        else:
+            stats['bad_parts'] += bad_parts
     return splits
 
 
-def replace_whole(orig, src, tgt, drop_chars):
-    """Replaces parts with whole"""
-    splits = un_split(orig, src, drop_chars)
+def un_split_all(pairs, drop_chars='', stats=None):
+    """
+    :param pairs: stream of (words, parts)
+    :param drop_chars: chars introduced to parts
+    :param stats: Counter for the parts which are not aligned, see un_split
+    :return: list of splits, see un_split
+    """
+    return [un_split(seq1, seq2, drop_chars, stats) for seq1, seq2 in pairs]
+
+
+def replace_whole(orig, src, tgt, drop_chars, splits=None, stats=None):
+    """
+    Replaces parts with whole
+    :param orig: original words
+    :param src: parts of words
+    :param tgt: target words
+    :param drop_chars: chars introduced to parts
+    :param splits: alignment of orig and src, computed when not given
+    :param stats: Counter for the number of ambiguous parts. When not given, ambiguities are logged
+    :return: target words, parts replaced with the whole words
+    """
+    if splits is None:
+        splits = un_split(orig, src, drop_chars)
     rev_lookup = {}
     for w, ss in zip(orig, splits):
-        for s in ss:
-            if rev_lookup.get(s, w) != w:
+        for s in ss or ():
+            prev = rev_lookup.setdefault(s, w)
+            if prev != w:
                 # FIXME : preserve positional info
-                log.warning(f"Ambiguous :: {s} is either from {w} or {rev_lookup[s]}")
-            rev_lookup[s] = w
-    src_vocab = set(src)
-    orig_vocab = set(orig)
-    result = []
-    for i, word in enumerate(tgt):
-        if word in src_vocab:  # this was copied
-            if word in orig_vocab:  # this is a full word
-                result.append(word)
-            else:    # this is a split word
-                tgt_word = rev_lookup[word]
-                if result and result[-1] == tgt_word:  # already copied, do nothing
-                    pass
+                if stats is None:
+                    log.warning(f"Ambiguous :: {s} is either from {w} or {prev}")
                 else:
-                    result.append(tgt_word)
-        else:
-            # it was translated
+                    stats['ambiguous'] += 1
+                rev_lookup[s] = w
+    for w in orig:      # full words are copied as they are
+        rev_lookup.pop(w, None)
+    result = []
+    for word in tgt:
+        tgt_word = rev_lookup.get(word)
+        if tgt_word is None:
+            # it was translated, or a full word copied, or a part which we could not align
             result.append(word)
+        elif not result or result[-1] != tgt_word:  # this is a split word, unless already copied
+            result.append(tgt_word)
     return result
 
 
-def run(inp, outp, drop_chars):
+def repair_lines(lines, drop_chars=''):
     """
-    Un split
-    :param outp:
-    :return:
+    Replaces parts with whole words in a batch of lines
+    :param lines: lines of format SOURCE SENTENCE<tab>SOURCE SPLIT SENTENCE<tab>TARGET SENTENCE
+    :param drop_chars: chars introduced to parts
+    :return: list of output lines, Counter of lines, bad_lines (not having 3 columns, output is empty),
+     bad_words (could not be aligned with parts), bad_parts (not aligned with any word), ambiguous parts
     """
-    for line in inp:
-        cols = line.strip().split('\t')
-        assert len(cols) == 3
+    res, stats = [], Counter()
+    for line in lines:
+        cols = line.rstrip('\r\n').split('\t')
+        if len(cols) != 3:
+            stats['bad_lines'] += 1
+            res.append('')
+            continue
         orig, src, tgt = tuple(x.split() for x in cols)
-        # print(orig, src, tgt)
-        result = replace_whole(orig, src, tgt, drop_chars)
-        result = ' '.join(result)
-        outp.write(result)
+        splits = un_split(orig, src, drop_chars, stats)
+        stats['bad_words'] += splits.count(None)
+        res.append(' '.join(replace_whole(orig, src, tgt, drop_chars, splits=splits, stats=stats)))
+    stats['lines'] += len(lines)
+    return res, stats
+
+
+def read_blocks(lines, block_size=10000):
+    """Groups a stream of lines into lists of block_size lines"""
+    lines = iter(lines)
+    while True:
+        block = list(islice(lines, block_size))
+        if not block:
+            break
+        yield block
+
+
+def map_blocks(func, blocks, workers=1, max_pending=None):
+    """
+    Maps func over blocks using a pool of processes, and yields the results in the same order as blocks.
+    Only max_pending blocks are in flight; results finished ahead of their turn wait in the reorder buffer.
+    :param func: picklable function
+    :param blocks: stream of blocks
+    :param workers: number of worker processes. When 1, runs in this process
+    :param max_pending: maximum blocks in flight, default is 4 x workers
+    :return: stream of results
+    """
+    if workers <= 1:
+        yield from map(func, blocks)
+        return
+    max_pending = max_pending or 4 * workers
+    with Pool(workers) as pool:
+        buffer = deque()
+        for block in blocks:
+            if len(buffer) >= max_pending:
+                yield buffer.popleft().get()
+            buffer.append(pool.apply_async(func, (block,)))
+        while buffer:
+            yield buffer.popleft().get()
+
+
+def run(inp, outp, drop_chars, block_size=10000, workers=1):
+    """
+    Un split
+    :param inp: stream of lines
+    :param outp: output stream
+    :param drop_chars: chars introduced to parts
+    :param block_size: number of lines processed in a batch
+    :param workers: number of worker processes
+    :return: Counter of stats, see repair_lines
+    """
+    stats = Counter()
+    start = time.time()
+    func = partial(repair_lines, drop_chars=drop_chars)
+    for res, block_stats in map_blocks(func, read_blocks(inp, block_size), workers=workers):
+        stats.update(block_stats)
+        outp.write('\n'.join(res))
         outp.write('\n')
+    elapsed = max(time.time() - start, 1e-9)
+    log.info(f"Lines: {stats['lines']}; Bad lines: {stats['bad_lines']}; Words not aligned: {stats['bad_words']};"
+             f" Parts not aligned: {stats['bad_parts']};"
+             f" Ambiguous parts: {stats['ambiguous']}")
+    log.info(f"Took {elapsed:.2f}s; {stats['lines'] / elapsed:.1f} lines/sec with {workers} workers")
+    return stats
 
 
 if __name__ == '__main__':
@@ -102,5 +232,7 @@ if __name__ == '__main__':
     p.add_argument('-out', nargs='?', help="Output file to write data.", type=argparse.FileType('w'),
                    default=sys.stdout)
     p.add_argument('-drop', nargs='?', help="Drop characters such as '-', '@@', that are affixed during the split.")
+    p.add_argument('-w', '--workers', type=int, default=1, help="Number of worker processes.")
+    p.add_argument('-block', type=int, default=10000, help="Number of lines sent to a worker at a time.")
     args = vars(p.parse_args())
-    run(args['in'], args['out'], args['drop'])
\ No newline at end of file
+    run(args['in'], args['out'], args['drop'], block_size=args['block'], workers=args['workers'])
@@ -2,11 +2,14 @@
 Custom Data Structures
 
 1. Trie - for prefix matching
+2. DAG - directed acyclic graph of nodes and edges
+3. DAWG - minimal automaton of words
+4. MorphGraph - DAG of words sharing the prefixes and suffixes
 """
 
 import logging as log
-from collections import defaultdict
-from pprint import pprint
+from array import array
+from collections import deque
 
 __author__ = 'Thamme Gowda'
 __created__ = 'October 9, 2017'
@@ -18,12 +21,15 @@ class Trie(object):
     """
     Trie data structure for fast suffix matching
     """
+    _path = None    # for the tries pickled before the paths were cached
+
     def __init__(self, name, parent):
         self.name = name
         self.parent = parent
         self.kids = {}
         self.is_term = False
         self.count = 0
+        self._path = None       # cached get_path()
 
     def add_word(self, word, pos=0):
         self.count += 1
@@ -32,7 +38,7 @@ class Trie(object):
             return
         ch = word[pos]
         if ch not in self.kids:
-            self.kids[ch] = Trie(ch, self)
+            self.kids[ch] = type(self)(ch, self)
         self.kids[ch].add_word(word, pos + 1)
 
     def prefix_match(self, word, pos=0):
@@ -52,27 +58,32 @@ class Trie(object):
         return self.kids[ch].is_terminal(word, pos + 1)
 
     def get_path(self):
-        txt = ''
-        n = self
-        while n:
-            txt = n.name + txt
-            n = n.parent
-        return txt
+        if self._path is None:
+            # walk up to the nearest node having the path, then fill the paths on the way down
+            chain = []
+            n = self
+            while n is not None and n._path is None:
+                chain.append(n)
+                n = n.parent
+            txt = n._path if n is not None else ''
+            for n in reversed(chain):
+                txt = n._path = txt + n.name
+        return self._path
 
     def bfs_nodes(self):
-        que = [self]
+        que = deque([self])
         while que:
-            node = que.pop(0)
+            node = que.popleft()
             yield node
             que.extend(node.kids.values())
 
     def bfs_edges(self):
-        que = [(None, self)]
+        que = deque([self])
         while que:
-            par, kid = que.pop(0)
-            if par is not None:
+            par = que.popleft()
+            for kid in par.kids.values():
                 yield (par, kid)
-            que.extend(map(lambda x: (kid, x), kid.kids.values()))
+                que.append(kid)
 
     def path(self, seq):
         nodes = []
@@ -98,17 +109,18 @@ class Trie(object):
         return self.name
 
     def __hash__(self):
-        return hash(self.get_path())
+        # a node is identified by the object, the path is unique only within a trie
+        return id(self)
 
     def __eq__(self, other):
-        return isinstance(other, Trie) and self.get_path() == other.get_path()
+        return self is other
 
     def __len__(self):
         return self.count
 
-    @staticmethod
-    def build(words):
-        root = Trie('/', None)
+    @classmethod
+    def build(cls, words):
+        root = cls('/', None)
         for word in words:
             if word is not None:
                 root.add_word(word)
@@ -116,36 +128,77 @@ class Trie(object):
 
 
 class DAG(object):
+    """
+    Directed acyclic graph. Nodes have integer ids (in the order they are added) and the edges are stored in
+    arrays of start and end node ids, so that the graph can have millions of edges.
+    Node objects are kept for the API; Edge objects are created on demand as views of the arrays.
+    """
 
     class Node(object):
+        __slots__ = ('uid', 'name', 'data', 'id', 'graph')
 
         def __init__(self, uid, name=None, **kwargs):
             assert uid is not None
             self.uid = uid
             self.name = name if name else self.uid
-            # store links to Nodes
-            self.ins = {}
-            self.outs = {}
             self.data = kwargs
+            self.id = None          # assigned when added to a graph
+            self.graph = None
+
+        @property
+        def ins(self):
+            return [DAG.Edge(self.graph, e) for e in self.graph._ins[self.id]]
+
+        @property
+        def outs(self):
+            return [DAG.Edge(self.graph, e) for e in self.graph._outs[self.id]]
 
         def __str__(self):
             return self.name
 
+        def __repr__(self):
+            return 'Node(%s)' % self.uid
+
     class Edge(object):
+        __slots__ = ('graph', 'id')
 
-        def __init__(self, start, end, uid=None, name=None, **kwargs):
-            self.start = start
-            self.end = end
-            self.uid = uid if uid else DAG.Edge.make_uid(start, end)
-            self.name = name if name else '%s-%s' % (start.name, end.name)
-            self.data = kwargs
+        def __init__(self, graph, id):
+            self.graph = graph
+            self.id = id
+
+        @property
+        def start(self):
+            return self.graph.nodes[self.graph._src[self.id]]
+
+        @property
+        def end(self):
+            return self.graph.nodes[self.graph._dst[self.id]]
+
+        @property
+        def name(self):
+            name = self.graph._edge_names[self.id]
+            return name if name is not None else '%s-%s' % (self.start.name, self.end.name)
+
+        @property
+        def uid(self):
+            uid = self.graph._edge_uids.get(self.id)
+            return uid if uid is not None else DAG.Edge.make_uid(self.start, self.end)
+
+        @property
+        def data(self):
+            return self.graph._edge_data.setdefault(self.id, {})
 
         def __str__(self):
             return self.name
 
-        def update_sig(self):
-            self.uid = DAG.Edge.make_uid(self.start, self.end)
-            self.name = '%s-%s' % (self.start.name, self.end.name)
+        def __repr__(self):
+            return 'Edge(%s)' % self.uid
+
+        def __eq__(self, other):
+            return isinstance(other, DAG.Edge) and self.graph is other.graph and self.id == other.id
+
+        def __hash__(self):
+            return hash(self.id)
 
         @staticmethod
         def make_uid(node1, node2):
@@ -153,114 +206,283 @@ class DAG(object):
 
     def __init__(self, name=""):
         self.name = name
-        self.node_idx = {}
-        self.edge_idx = {}
+        self.nodes = []             # id -> Node; None for the merged nodes
+        self.node_idx = {}          # uid -> id
+        self._outs = []             # node id -> array of edge ids
+        self._ins = []
+        self._src = array('q')      # edge id -> start node id; -1 for the removed edges
+        self._dst = array('q')      # edge id -> end node id
+        self._edge_names = []       # edge id -> name, None for default
+        self._edge_uids = {}        # edge id -> uid, only when given explicitly
+        self._edge_idx = {}         # explicitly given uid -> edge id
+        self._edge_data = {}        # edge id -> dict, only for the edges having data
 
     def add_nodes(self, nodes):
         for node in nodes:
             self.add_node(node)
 
     def add_node(self, node):
-        # print(node, type(node), isinstance(node, self.Node))
         assert isinstance(node, self.Node)
         assert node.uid not in self.node_idx
-        self.node_idx[node.uid] = node
-
-    def connect(self, start, end, **kwargs):
-        if type(start) is str and start in self.node_idx:
-            start = self.node_idx[start]
-        if type(end) is str and end in self.node_idx:
-            end = self.node_idx[end]
-        assert isinstance(start, self.Node), '%s is not a known Node ' % start
-        assert isinstance(end, self.Node), '%s is not a known Node' % end
-        if start.uid not in self.node_idx or end.uid not in self.node_idx:
-            log.error("Cant connect %s -> %s " % (start.uid, end.uid))
-        assert start.uid in self.node_idx
-        assert end.uid in self.node_idx
-        edge = self.Edge(start, end, **kwargs)
-        self.add_edge(edge)
+        assert node.graph is None, '%s is already in a graph' % node.uid
+        node.id, node.graph = len(self.nodes), self
+        self.node_idx[node.uid] = node.id
+        self.nodes.append(node)
+        self._outs.append(array('q'))
+        self._ins.append(array('q'))
+        return node
+
+    def _node_id(self, node):
+        if isinstance(node, self.Node):
+            assert node.graph is self, '%s is not a node of this graph' % node.uid
+            return node.id
+        assert node in self.node_idx, '%s is not a known Node' % node
+        return self.node_idx[node]
+
+    def connect(self, start, end, uid=None, name=None, **kwargs):
+        """
+        Adds an edge
+        :param start: start node or its uid
+        :param end: end node or its uid
+        :param uid: edge uid, default is derived from the uids of nodes
+        :param name: edge name, default is derived from the names of nodes
+        :param kwargs: edge data
+        :return: edge
+        """
+        edge = self.connect_ids(self._node_id(start), self._node_id(end), name=name)
+        if uid is not None:
+            self._edge_uids[edge] = uid
+            self._edge_idx[uid] = edge
+        if kwargs:
+            self._edge_data[edge] = kwargs
+        return self.Edge(self, edge)
+
+    def connect_ids(self, start, end, name=None):
+        """
+        Adds an edge between nodes identified by their integer ids. This is the fast path for building large graphs
+        :return: edge id
+        """
+        edge = len(self._src)
+        self._src.append(start)
+        self._dst.append(end)
+        self._edge_names.append(name)
+        self._outs[start].append(edge)
+        self._ins[end].append(edge)
         return edge
 
     def connect_all(self, pairs):
         for start, end in pairs:
             self.connect(start, end)
 
-    def add_edges(self, edges):
-        for edge in edges:
-            self.add_edge(edge)
-
-    def add_edge(self, edge):
-        assert isinstance(edge, self.Edge)
-        edge.start.outs[edge.name] = edge
-        edge.end.ins[edge.name] = edge
-        self.edge_idx[edge.uid] = edge
-
     def get_node(self, uid):
-        return self.node_idx[uid]
+        return self.nodes[self.node_idx[uid]]
 
     def get_nodes(self):
-        return self.node_idx.values()
+        return [node for node in self.nodes if node is not None]
 
     def get_edge(self, uid):
-        return self.edge_idx[uid]
+        """
+        :param uid: edge id or explicitly given edge uid
+        :return: edge
+        """
+        edge = uid if isinstance(uid, int) else self._edge_idx[uid]
+        assert self._src[edge] >= 0, 'edge %s is removed' % uid
+        return self.Edge(self, edge)
+
+    def find_edges(self, start, end):
+        """
+        :return: edges from start node to end node
+        """
+        end = self._node_id(end)
+        return [self.Edge(self, e) for e in self._outs[self._node_id(start)] if self._dst[e] == end]
 
     def get_edges(self):
-        return self.edge_idx.values()
+        return [self.Edge(self, e) for e, start in enumerate(self._src) if start >= 0]
+
+    def num_edges(self):
+        return sum(len(outs) for outs in self._outs)
+
+    def _remove_edge(self, edge):
+        self._outs[self._src[edge]].remove(edge)
+        self._ins[self._dst[edge]].remove(edge)
+        self._src[edge] = self._dst[edge] = -1
+        self._edge_data.pop(edge, None)
 
     def merge_nodes(self, node1, node2):
         """
         Merges two nodes and returns a resulting merged node.
-        The default implementation simply copies second node to first, removes the second, and returns the first arg
+        The default implementation moves the edges of second node to first, removes the second,
+        and returns the first arg. Edges between the two nodes are removed, since they would be loops.
+        It takes time proportional to the degree of nodes.
         :param node1: first node
         :param node2: second node
         :return: merged node
         """
-        new_node = node1
-        # update incoming edges of node2
-        # update outgoing edges of node2
-        # copy data from node2 to node1
-        # remove node 2
-        # update edge UIDs, since edge uids are derived from node uids
-        edge_updates = {}
-        edge_removals = set()
-        for edge, prev_node in node2.ins.items():
-            edge.end = new_node
-            prev_node.outs[edge] = new_node
-            new_node.ins[edge] = prev_node
-            edge_removals.add(edge.uid)
-            edge.update_sig()
-            edge_updates[edge.uid] = edge
-
-        for edge, nxt_node in node2.outs.items():
-            edge.start = new_node
-            nxt_node.ins[edge] = new_node
-            new_node.outs[edge] = nxt_node
-            edge_removals.add(edge.uid)     # remove current ID
-            edge.update_sig()
-            edge_updates[edge.uid] = edge
+        id1, id2 = self._node_id(node1), self._node_id(node2)
+        assert id1 != id2
+        node1, node2 = self.nodes[id1], self.nodes[id2]
+        for edge in [e for e in self._outs[id2] if self._dst[e] == id1] + \
+                    [e for e in self._ins[id2] if self._src[e] == id1]:
+            self._remove_edge(edge)
+        for edge in self._ins[id2]:
+            self._dst[edge] = id1
+        for edge in self._outs[id2]:
+            self._src[edge] = id1
+        self._ins[id1].extend(self._ins[id2])
+        self._outs[id1].extend(self._outs[id2])
+        self._ins[id2], self._outs[id2] = array('q'), array('q')
 
         # TODO: proper merge of data
         node1.data['merged_%s' % node2.uid] = node2.data
-        if node2.uid in self.node_idx:
-            log.info("Delete node %s" % node2.uid)
-            del self.node_idx[node2.uid]
-        # edges UID index is to be updated because uid = <node1>-<node2>
-        for e_uid in edge_removals:
-            if e_uid in self.edge_idx:
-                log.info("Delete EDGE %s" % e_uid)
-                del self.edge_idx[e_uid]
-        self.edge_idx.update(edge_updates)
-        return new_node
+        del self.node_idx[node2.uid]
+        self.nodes[id2] = None
+        node2.id, node2.graph = None, None
+        return node1
 
     def to_networkx(self):
         import networkx as nx
         DG = nx.DiGraph()
-        DG.add_nodes_from(self.get_nodes())
-        DG.add_edges_from((e.start, e.end, {'label': e.name}) for e in self.get_edges())
+        DG.add_nodes_from((node.uid, {'name': node.name}) for node in self.nodes if node is not None)
+        uids = [node.uid if node is not None else None for node in self.nodes]
+        DG.add_edges_from((uids[start], uids[end], {'label': self.Edge(self, e).name})
+                          for e, (start, end) in enumerate(zip(self._src, self._dst)) if start >= 0)
         return DG
 
 
+class DAWG(object):
+    """
+    Minimal acyclic deterministic automaton (aka DAWG) of a set of words. It is built incrementally in a single pass
+    over sorted words, and the equivalent states are shared using a register, as in
+    Daciuk et al. (2000) Incremental Construction of Minimal Acyclic Finite-State Automata.
+    States are integers, 0 is the start state; trans[state] is a dict of char -> next state.
+    """
+
+    def __init__(self):
+        self.trans = [{}]
+        self.final = [False]
+        self.register = {}          # signature -> state
+        self.unchecked = []         # (parent, char, child) on the path of the last word, not yet minimized
+        self.prev_word = ''
+        self.num_words = 0
+
+    def _new_state(self):
+        self.trans.append({})
+        self.final.append(False)
+        return len(self.trans) - 1
+
+    def add(self, word):
+        """
+        Adds a word. Words should be added in sorted order
+        :param word: word
+        """
+        if word <= self.prev_word:
+            if word == self.prev_word:
+                return
+            raise Exception('Words should be added in sorted order: %s after %s' % (word, self.prev_word))
+        common = 0
+        for a, b in zip(word, self.prev_word):
+            if a != b:
+                break
+            common += 1
+        self._minimize(common)
+        state = self.unchecked[-1][2] if self.unchecked else 0
+        for ch in word[common:]:
+            nxt = self._new_state()
+            self.trans[state][ch] = nxt
+            self.unchecked.append((state, ch, nxt))
+            state = nxt
+        self.final[state] = True
+        self.prev_word = word
+        self.num_words += 1
+
+    def _minimize(self, down_to):
+        # replace the states on the path of the last word, deeper than down_to, by their equivalents
+        while len(self.unchecked) > down_to:
+            parent, ch, child = self.unchecked.pop()
+            sig = (self.final[child], tuple(sorted(self.trans[child].items())))
+            if sig in self.register:
+                self.trans[parent][ch] = self.register[sig]
+                self.trans[child] = None        # orphan, removed by finish()
+            else:
+                self.register[sig] = child
+
+    def finish(self):
+        """
+        Minimizes the path of last word and renumbers the states to fill the gaps of removed states.
+        No words can be added after this.
+        """
+        self._minimize(0)
+        self.register = None
+        ids = {0: 0}
+        order = [0]
+        for state in order:     # BFS
+            for nxt in self.trans[state].values():
+                if nxt not in ids:
+                    ids[nxt] = len(order)
+                    order.append(nxt)
+        self.trans = [{ch: ids[nxt] for ch, nxt in self.trans[state].items()} for state in order]
+        self.final = [self.final[state] for state in order]
+        return self
+
+    @staticmethod
+    def build(words):
+        """
+        :param words: words, need not be sorted
+        :return: minimal DAWG
+        """
+        dawg = DAWG()
+        for word in sorted(set(words)):
+            if word:
+                dawg.add(word)
+        return dawg.finish()
+
+    def __contains__(self, word):
+        state = 0
+        for ch in word:
+            state = self.trans[state].get(ch)
+            if state is None:
+                return False
+        return self.final[state]
+
+    def num_states(self):
+        return len(self.trans)
+
+    def num_edges(self):
+        return sum(len(t) for t in self.trans)
+
+    def edges(self):
+        """
+        :return: stream of (state, char, next_state)
+        """
+        for state, kids in enumerate(self.trans):
+            for ch, nxt in kids.items():
+                yield state, ch, nxt
+
+    def to_dag(self, dag=None, start='^', end='$'):
+        """
+        Exports to DAG view; states are nodes and chars are the edge names.
+        The final states are connected to an end node.
+        :param dag: DAG to add the nodes and edges to; a new DAG is created when not given
+        :param start: uid of the start state
+        :param end: uid of the end node
+        :return: the dag
+        """
+        dag = dag if dag is not None else DAG()
+        ids = [dag.add_node(DAG.Node(start)).id]
+        ids += [dag.add_node(DAG.Node(str(state))).id for state in range(1, len(self.trans))]
+        end_id = dag.add_node(DAG.Node(end)).id
+        for state, ch, nxt in self.edges():
+            dag.connect_ids(ids[state], ids[nxt], name=ch)
+        for state, is_final in enumerate(self.final):
+            if is_final:
+                dag.connect_ids(ids[state], end_id, name=end)
+        return dag
+
+
 class MorphGraph(DAG):
+    """
+    Graph of words in which the common prefixes and suffixes are shared, i.e. minimal DAWG of words
+    """
 
     def __init__(self, words, name="", start="^", end="$"):
         assert type(words) in (list, set)
@@ -269,78 +491,7 @@ class MorphGraph(DAG):
         self.start = start
         self.end = end
         self.words = words
-        self.prf_trie = Trie.build(words)
-        self.suf_trie = Trie.build(w[::-1] for w in words)
-        self.G = self.__merge()
-
-    def __merge(self):
-        start_node = self.Node(self.start)
-        end_node = self.Node(self.end)
-        self.add_nodes((start_node, end_node))
-
-        prf_map = {}
-        prf_map_rev = defaultdict(set)
-        suf_map = {}
-        suf_map_rev = defaultdict(set)
-        edges = set()
-        eps_edges = set()
-        for w in self.words:
-            prf_path, pcut = self.prf_trie.path(w)
-            suf_path, scut = self.suf_trie.path(w[::-1])
-            assert pcut == scut == ''
-            # print("==%s==" % w)
-            prev_node = start_node
-            assert len(prf_path) == len(suf_path) == len(w)
-            for pn, sn, ch in zip(prf_path, suf_path[::-1], w):
-                # print(ch, pn.get_path(), sn.get_path())
-                # case 1: no mapping exists => new node
-                if pn not in prf_map and sn not in suf_map:
-                    cur_node = self.Node(uid=pn.get_path(), name=ch)
-                    self.add_node(cur_node)
-                    prf_map[pn] = cur_node
-                    prf_map_rev[cur_node].add(pn)
-                    suf_map[sn] = cur_node
-                    suf_map_rev[cur_node].add(sn)
-
-                # case 2: One mapping exists
-                # case 2a: prefix mapping exists
-                elif pn in prf_map and sn not in suf_map:
-                    cur_node = prf_map[pn]
-                    suf_map[sn] = cur_node
-                    suf_map_rev[cur_node].add(sn)
-
-                # case 2b: suffix mapping exists
-                elif pn not in prf_map and sn in suf_map:
-                    assert sn in suf_map
-                    cur_node = suf_map[sn]
-                    prf_map[pn] = cur_node
-                    prf_map_rev[cur_node].add(pn)
-
-                # case 3: Both mapping exists
-                elif pn in prf_map and sn in suf_map:
-                    #  - case 3a: both mapped to same node
-                    if prf_map[pn] == suf_map[sn]:
-                        cur_node = prf_map[pn]
-                    # - case 3b: both are mapped to different node in merged graph --> merge them
-                    else:
-                        node1 = prf_map[pn]
-                        node2 = suf_map[sn]
-                        # tried to merge - it creates cycles in the DAG, pretty messed up here
-                        # So just inserting non deterministic edge from pref_node to suf_node
-                        cur_node = node2
-                        eps_edges.add((node1, node2))
-                else:
-                    print(pn in prf_map, sn in suf_map)
-                    raise Exception('Shouldnt happen! - Case not handled')
-
-                # save edges to add later
-                edges.add((prev_node.uid, cur_node.uid))
-                prev_node = cur_node
-            edges.add((prev_node.uid, end_node.uid))
-
-        print("%d edges " % len(edges))
-        self.connect_all(edges)
-
-        for start, end in eps_edges:
-            self.connect(start, end, name='ϵ', epsilon=True)
-
+        self.dawg = DAWG.build(words)
+        self.dawg.to_dag(self, start=start, end=end)
+        log.info("%d words, %d states, %d edges" % (self.dawg.num_words, self.dawg.num_states(),
+                                                     self.dawg.num_edges()))
@@ -1,60 +1,290 @@
-from codecs import open as copen
+import gzip
+import json
+import os
+import re
+import sys
+from array import array
 from lxml import etree as ET
 
+from sink import Sink
+
+
+class Vocab(object):
+    """
+    Interned vocabulary of strings, maps strings to small integer ids and back
+    """
+    def __init__(self, items=()):
+        self.id2str = []
+        self.str2id = {}
+        for item in items:
+            self.index(item)
+
+    def index(self, item):
+        """
+        Gets the id of the item, adds it to the vocabulary if it is new
+        :param item: string
+        :return: integer id
+        """
+        idx = self.str2id.get(item)
+        if idx is None:
+            idx = self.str2id[item] = len(self.id2str)
+            self.id2str.append(item)
+        return idx
+
+    def __getitem__(self, idx):
+        return self.id2str[idx]
+
+    def __len__(self):
+        return len(self.id2str)
+
+    # one item per line; backslash, newline and carriage return in the items are escaped
+    ESCAPES = {'\\': '\\\\', '\n': '\\n', '\r': '\\r'}
+    UNESCAPES = {'\\': '\\', 'n': '\n', 'r': '\r'}
+    ESCAPE_RE = re.compile(r'[\\\n\r]')
+    UNESCAPE_RE = re.compile(r'\\(.)')
+
+    def save(self, path):
+        escape = lambda m: self.ESCAPES[m.group(0)]
+        with open(path, 'w', encoding='utf-8', newline='\n') as out:
+            for item in self.id2str:
+                out.write(self.ESCAPE_RE.sub(escape, item))
+                out.write('\n')
+
+    @staticmethod
+    def load(path):
+        unescape = lambda m: Vocab.UNESCAPES.get(m.group(1), m.group(1))
+        with open(path, encoding='utf-8', newline='\n') as f:
+            return Vocab(Vocab.UNESCAPE_RE.sub(unescape, line[:-1] if line.endswith('\n') else line) for line in f)
+
+
+TAG_MAP = {'unknown': 'UNK', 'translation': 'T', 'identity': 'IDEN'}
+MAX_TAGS = 1 << 16      # tag ids are stored as unsigned shorts
+
+
+def tag_mapper(tag):
+    return TAG_MAP.get(tag, tag)
+
+
+def new_tag_vocab():
+    """
+    :return: new tag vocabulary having the known tags
+    """
+    return Vocab(TAG_MAP.values())
+
+
+# tags of the segments created without a tag vocab, shared so that their tags are interned too
+DEFAULT_TAG_VOCAB = new_tag_vocab()
+
 
 class Segment(object):
     """
-    Segment data structure
+    Segment data structure.
+    Tokens are interned and tags are stored as an array of ids in the tag vocabulary
     """
-    def __init__(self, src_id, tgt_id, src, tgt_tokens, tgt_tags):
+    __slots__ = ('src_id', 'tgt_id', 'src', 'tgt_tokens', 'tag_ids', 'tag_vocab')
+
+    def __init__(self, src_id, tgt_id, src, tgt_tokens, tgt_tags, tag_vocab=None):
+        """
+        :param tag_vocab: Vocab for the tags, shared by the segments of a package. New unknown tags are added to it.
+            Default is DEFAULT_TAG_VOCAB
+        """
         assert src and tgt_tokens and tgt_tags
         assert len(tgt_tokens) == len(tgt_tags)
         self.src = src
-        self.tgt_tokens = tgt_tokens
-        self.tgt_tags = tgt_tags
+        self.tgt_tokens = tuple(sys.intern(tok) if tok else tok for tok in tgt_tokens)
+        if tag_vocab is None:
+            tag_vocab = DEFAULT_TAG_VOCAB
+        tag_ids = list(map(tag_vocab.index, tgt_tags))
+        if len(tag_vocab) > MAX_TAGS:
+            raise Exception('Too many tags: %d, only %d are supported' % (len(tag_vocab), MAX_TAGS))
+        self.tag_ids = array('H', tag_ids)
+        self.tag_vocab = tag_vocab
         self.src_id = src_id
         self.tgt_id = tgt_id
 
+    @property
+    def tgt_tags(self):
+        """
+        :return: new list of the tags, decoded from the tag ids
+        """
+        return list(self._tags())
+
+    def _tags(self):
+        return map(self.tag_vocab.__getitem__, self.tag_ids)
+
     def get_tokens(self):
-        return zip(self.tgt_tokens, self.tgt_tags)
+        return zip(self.tgt_tokens, self._tags())
 
     def __repr__(self):
-        tags = ' '.join(map(lambda x: '%s/%s' % (x[0], x[1]), zip(self.tgt_tokens, self.tgt_tags)))
+        tags = ' '.join(map(lambda x: '%s/%s' % (x[0], x[1]), zip(self.tgt_tokens, self._tags())))
         return '''Segment(...%s ...%s, %s --> %s''' % \
                (self.src_id[-4:], self.tgt_id[-4:], self.src, tags)
 
 
-TAG_MAP = {'unknown': 'UNK', 'translation': 'T', 'identity': 'IDEN'}
-def tag_mapper(tag):
-    return TAG_MAP.get(tag, tag)
+# smart_strings=False : plain strings, they dont keep a reference to the (cleared) elements
+SRC_ID = ET.XPath('.//SOURCE/@id', smart_strings=False)
+TGT_ID = ET.XPath('.//TARGET/@id', smart_strings=False)
+SRC_TEXT = ET.XPath('.//ULF_LRLP_TOKENIZED_SOURCE/text()', smart_strings=False)
+TGT_TOKENS = ET.XPath('.//TOKENIZED_TARGET/TOKEN')
 
 
-def parse_elisa(path):
+def parse_segment(seg_el, tag_vocab=None):
     """
-    Parse elisa package
-    :param path:
-    :return:
+    Parses a SEGMENT element
+    :param seg_el: SEGMENT element
+    :param tag_vocab: Vocab for the tags
+    :return: Segment
     """
-    tree = ET.parse(path)
-    for seg_el in tree.xpath('//SEGMENT'):
-        src_id = seg_el.xpath('.//SOURCE/@id')[0]
-        tgt_id = seg_el.xpath('.//TARGET/@id')[0]
-        src = seg_el.xpath('.//ULF_LRLP_TOKENIZED_SOURCE/text()')[0]
-        tok_els = seg_el.findall('.//TOKENIZED_TARGET/TOKEN')
-        tokens = [tok.text for tok in tok_els]
+    src_id = SRC_ID(seg_el)[0]
+    tgt_id = TGT_ID(seg_el)[0]
+    src = SRC_TEXT(seg_el)[0]
+    tok_els = TGT_TOKENS(seg_el)
+    tokens = [tok.text for tok in tok_els]
+    tags = [tag_mapper(tok.attrib['rule-class']) for tok in tok_els]
+    return Segment(src_id, tgt_id, src, tokens, tags, tag_vocab)
+
 
-        tags = [tag_mapper(tok.attrib['rule-class']) for tok in tok_els]
-        yield Segment(src_id, tgt_id, src, tokens, tags)
+def parse_elisa(path, compressed=None, tag_vocab=None):
+    """
+    Parse elisa package.
+    The XML is streamed, segments are cleared from memory as soon as they are parsed
+    :param path: path to elisa package
+    :param compressed: is the package gzip compressed? Default is to guess from '.gz' extension
+    :param tag_vocab: Vocab for the tags of segments. Default is a new one for this package
+    :return: stream of Segments
+    """
+    if compressed is None:
+        compressed = path.endswith('.gz')
+    if tag_vocab is None:
+        tag_vocab = new_tag_vocab()
+    with (gzip.open(path, 'rb') if compressed else open(path, 'rb')) as inp:
+        for _, seg_el in ET.iterparse(inp, events=('end',), tag='SEGMENT'):
+            yield parse_segment(seg_el, tag_vocab)
+            # free the processed segment and its already processed siblings
+            seg_el.clear()
+            while seg_el.getprevious() is not None:
+                del seg_el.getparent()[0]
 
 
-def dump_stream(recs, path):
+class ColumnarCorpus(object):
+    """
+    ELISA corpus stored in columns on disk, the arrays are memory mapped with numpy.
+    Files in the directory:
+        tokens.i32    token ids of all the segments concatenated
+        offsets.i64   start of each segment in tokens, the last one is the end
+        tags.u16      tag ids, aligned with tokens
+        vocab.txt     token vocabulary
+        tags.txt      tag vocabulary
+        segments.tsv  src_id, tgt_id, src of each segment
+        meta.json     counts
+    """
+    TOKENS, OFFSETS, TAGS = 'tokens.i32', 'offsets.i64', 'tags.u16'
+    VOCAB, TAG_VOCAB, SEGMENTS, META = 'vocab.txt', 'tags.txt', 'segments.tsv', 'meta.json'
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, self.META)) as f:
+            self.meta = json.load(f)
+        self.vocab = Vocab.load(os.path.join(path, self.VOCAB))
+        self.tag_vocab = Vocab.load(os.path.join(path, self.TAG_VOCAB))
+        self.offsets = self._map(self.OFFSETS, 'int64')
+        self.tokens = self._map(self.TOKENS, 'int32')
+        self.tags = self._map(self.TAGS, 'uint16')
+        assert len(self.offsets) == self.meta['segments'] + 1
+        assert len(self.tokens) == len(self.tags) == self.meta['tokens']
+
+    def _map(self, name, dtype):
+        import numpy as np
+        path = os.path.join(self.path, name)
+        if os.path.getsize(path) == 0:      # empty files can not be memory mapped
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        """
+        :param idx: segment index
+        :return: token ids, tag ids of the segment
+        """
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.tokens[start:end], self.tags[start:end]
+
+    @staticmethod
+    def export(segs, path, tag_vocab=None, batch_size=100000):
+        """
+        Writes segments in columnar format.
+        :param segs: stream of Segments
+        :param path: output directory
+        :param tag_vocab: Vocab for the tags. The tag ids of the segments having this vocab are copied as they are,
+         the tags of other segments are mapped to it. Default is the tag vocab of first segment
+        :param batch_size: number of tokens to buffer before flushing to disk
+        :return: ColumnarCorpus
+        """
+        os.makedirs(path, exist_ok=True)
+        C = ColumnarCorpus
+        vocab = Vocab()
+        tokens, offsets, tags = array('i'), array('q', [0]), array('H')
+        n_segs, n_toks = 0, 0
+        with open(os.path.join(path, C.TOKENS), 'wb') as tok_out, \
+                open(os.path.join(path, C.OFFSETS), 'wb') as off_out, \
+                open(os.path.join(path, C.TAGS), 'wb') as tag_out, \
+                open(os.path.join(path, C.SEGMENTS), 'w', encoding='utf-8') as seg_out:
+            for seg in segs:
+                if tag_vocab is None:
+                    tag_vocab = seg.tag_vocab
+                tokens.extend(vocab.index(tok or '') for tok in seg.tgt_tokens)
+                if seg.tag_vocab is tag_vocab:
+                    tags.extend(seg.tag_ids)
+                else:
+                    tag_ids = list(map(tag_vocab.index, seg.tgt_tags))
+                    if len(tag_vocab) > MAX_TAGS:
+                        raise Exception('Too many tags: %d, only %d are supported' % (len(tag_vocab), MAX_TAGS))
+                    tags.extend(tag_ids)
+                n_toks += len(seg.tag_ids)
+                offsets.append(n_toks)
+                n_segs += 1
+                seg_out.write('%s\t%s\t%s\n' % (seg.src_id, seg.tgt_id, seg.src.replace('\n', ' ')))
+                if len(tokens) >= batch_size:
+                    C._flush(tokens, tok_out)
+                    C._flush(offsets, off_out)
+                    C._flush(tags, tag_out)
+            C._flush(tokens, tok_out)
+            C._flush(offsets, off_out)
+            C._flush(tags, tag_out)
+        vocab.save(os.path.join(path, C.VOCAB))
+        (tag_vocab or new_tag_vocab()).save(os.path.join(path, C.TAG_VOCAB))
+        with open(os.path.join(path, C.META), 'w') as out:
+            json.dump({'segments': n_segs, 'tokens': n_toks, 'vocab': len(vocab)}, out)
+        return ColumnarCorpus(path)
+
+    @staticmethod
+    def _flush(arr, out):
+        arr.tofile(out)
+        del arr[:]
+
+
+def dump_stream(recs, path, **kwargs):
     """
     writes lines to file
     :param recs: stream of lines
-    :param path: file path
+    :param path: file path. Output is compressed when path ends with .gz or .zst
+    :param kwargs: other args to sink.Sink
     :return:
     """
-    with copen(path, 'w', 'utf-8') as out:
+    with Sink(path, **kwargs) as out:
         for rec in recs:
-            out.write(rec)
-            out.write('\n')
+            out.writeline(rec)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Exports ELISA package to memory mappable columnar format')
+    parser.add_argument('-i', '--in', help='ELISA package path (.xml or .xml.gz)', required=True)
+    parser.add_argument('-o', '--out', help='Output directory', required=True)
+    args = vars(parser.parse_args())
+    tags = new_tag_vocab()
+    corpus = ColumnarCorpus.export(parse_elisa(args['in'], tag_vocab=tags), args['out'], tag_vocab=tags)
+    print("Exported %d segments, %d tokens, %d types to %s"
+          % (len(corpus), corpus.meta['tokens'], corpus.meta['vocab'], args['out']))
@@ -8,6 +8,7 @@ import os
 import glob
 import pickle
 from ds import Trie
+from instrument import profiler
 
 log.basicConfig(level=log.INFO)
 __author__ = 'Thamme Gowda'
@@ -37,26 +38,33 @@ class TTable(object):
         log.info("Vocabulary Files: SRC: %s; TGT:%s" % (src_vcb, tgt_vcb))
         assert 1 == len(src_vcb) == len(tgt_vcb)
         src_vcb, tgt_vcb = src_vcb[0], tgt_vcb[0]
-        self.src_id2tok, self.src_freq = TTable.load_vocab(src_vcb)
-        self.tgt_id2tok, self.tgt_freq = TTable.load_vocab(tgt_vcb)
+        with profiler.stage('load'):
+            self.src_id2tok, self.src_freq = TTable.load_vocab(src_vcb)
+            self.tgt_id2tok, self.tgt_freq = TTable.load_vocab(tgt_vcb)
         self.src_tok2id, self.tgt_tok2id = TTable.reverse_map(self.src_id2tok), TTable.reverse_map(self.tgt_id2tok)
         log.info("Vocabulary Size: SRC: %d; TGT:%d" % (len(self.src_id2tok), len(self.tgt_id2tok)))
 
         ttab_file = glob.glob(self.dir + '/*normal.t[0-9]*.final')
         inv_ttab_file = glob.glob(self.dir + '/*invers.t[0-9]*.final')
         assert ttab_file
-        self.ttab = self.read_ttab(ttab_file[0], self.src_id2tok, self.tgt_id2tok)
-        self.inv_ttab = self.read_ttab(inv_ttab_file[0], self.tgt_id2tok, self.src_id2tok) if inv_ttab_file else {}
+        with profiler.stage('parse'):
+            self.ttab = self.read_ttab(ttab_file[0], self.src_id2tok, self.tgt_id2tok)
+            self.inv_ttab = self.read_ttab(inv_ttab_file[0], self.tgt_id2tok, self.src_id2tok) if inv_ttab_file else {}
+        profiler.count('parse', sum(map(len, self.ttab.values())) + sum(map(len, self.inv_ttab.values())))
         log.info("T-Tab Size: Normal: %d; inverse:%d" % (len(self.ttab), len(self.inv_ttab)))
 
         # prefix trie
-        self.src_trie = Trie.build(self.src_tok2id.keys())
-        self.tgt_trie = Trie.build(self.tgt_tok2id.keys())
+        with profiler.stage('index'):
+            self.src_trie = Trie.build(self.src_tok2id.keys())
+            self.tgt_trie = Trie.build(self.tgt_tok2id.keys())
+        profiler.count('index', len(self.src_tok2id) + len(self.tgt_tok2id))
         log.info("Trie size: SRC: %d; TGT:%d" % (len(self.src_trie), len(self.tgt_trie)))
 
+    @profiler.timed('write')
     def store_at(self, path):
         log.info('storing at %s' % path)
-        pickle.dump(self, open(path, 'wb'))
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
 
     def vocab_match(self, pattern, source=True):
         # TODO: use a trie to support prefix match
@@ -76,6 +84,7 @@ class TTable(object):
         return rev
 
     @staticmethod
+    @profiler.timed('load')
     def load_from(path):
         log.info("Loading from %s" % path)
         ttab = pickle.load(open(path, 'rb'))
@@ -134,9 +143,11 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--src', help='Source language code. Example: esp', required=True)
     parser.add_argument('-t', '--tgt', help='Target language code. Example: eng', required=True)
     parser.add_argument('-o', '--out', help='Store the compressed T-Tab at this path', required=True)
+    profiler.add_argument(parser)
     args = vars(parser.parse_args())
-    ttab = TTable(args['giza'], src=args['src'], tgt=args['tgt'])
-    out = args['out']
-    if not out.endswith('.pkl') and not out.endswith('.pickle'):
-        out += '.pkl'
-    ttab.store_at(out)
+    with profiler.session(args['profile'], args['pstats']):
+        ttab = TTable(args['giza'], src=args['src'], tgt=args['tgt'])
+        out = args['out']
+        if not out.endswith('.pkl') and not out.endswith('.pickle'):
+            out += '.pkl'
+        ttab.store_at(out)
@@ -0,0 +1,201 @@
+"""
+Lightweight instrumentation for the CLI tools: named timers and counters for the stages such as
+load, parse, lookup, score and write, and an optional cProfile dump.
+
+Usage:
+    from instrument import profiler
+
+    @profiler.timed('load')
+    def load(path): ...
+
+    with profiler.stage('score'):
+        ...
+    profiler.count('score', len(items))
+
+    # in the loops over many small items, laps are cheaper than a stage per item
+    lap = profiler.laps()
+    for item in items:
+        ...
+        lap('parse')
+        ...
+        lap('score')
+
+In the CLI:
+    profiler.add_argument(parser)
+    with profiler.session(args['profile'], args['pstats']):
+        main()
+
+Stages can be nested, the time of inner stage is also included in the outer stage.
+Nothing is measured unless the session is enabled with --profile, the disabled timers are no-ops.
+"""
+import sys
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+__version__ = '0.1'
+
+
+class _NoOp(object):
+    """Context manager which does nothing; shared by all the stages when profiler is disabled"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _no_lap(name):
+    """Stopwatch which does nothing; returned by profiler.laps() when profiler is disabled"""
+
+
+class _Timer(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler(object):
+
+    NO_OP = _NoOp()
+
+    def __init__(self):
+        self.enabled = False
+        self.times = OrderedDict()      # stage -> seconds, in the order of first use
+        self.calls = Counter()
+        self.counts = Counter()
+        self.start_time = None
+        self._cprofile = None
+
+    def stage(self, name):
+        """
+        :param name: name of stage
+        :return: context manager which times the block as the stage
+        """
+        return _Timer(self, name) if self.enabled else self.NO_OP
+
+    def timed(self, name=None):
+        """
+        Decorator for timing the calls to a function as a stage
+        :param name: name of stage, default is the function name
+        """
+        def decorate(func):
+            stage_name = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Timer(self, stage_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def laps(self):
+        """
+        Stopwatch for the loops: lap(name) adds the time since the previous lap to the stage,
+         lap(None) restarts the stopwatch without adding the time to any stage
+        :return: lap function; a no-op when disabled
+        """
+        if not self.enabled:
+            return _no_lap
+        clock = time.perf_counter
+        last = [clock()]
+
+        def lap(name):
+            now = clock()
+            if name is not None:
+                self.add_time(name, now - last[0])
+            last[0] = now
+        return lap
+
+    def add_time(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.calls[name] += 1
+
+    def count(self, name, n=1):
+        """
+        Counts the items processed in a stage, the report shows the items/sec of the stages having counts
+        """
+        if self.enabled:
+            self.counts[name] += n
+
+    def enable(self, pstats_path=None):
+        """
+        :param pstats_path: when given, the whole session is profiled with cProfile and the stats are dumped here
+        """
+        self.enabled = True
+        self.times.clear()
+        self.calls.clear()
+        self.counts.clear()
+        self.start_time = time.perf_counter()
+        if pstats_path:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def disable(self, pstats_path=None):
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(pstats_path)
+            self._cprofile = None
+        self.enabled = False
+
+    def report(self, out=sys.stderr):
+        """Writes the per stage breakdown"""
+        total = time.perf_counter() - self.start_time
+        out.write('%-16s %10s %7s %10s %12s %14s\n' % ('stage', 'seconds', '%', 'calls', 'items', 'items/sec'))
+        for name, secs in self.times.items():
+            items = self.counts.get(name)
+            rate = '%14.1f' % (items / secs) if items and secs > 0 else '%14s' % '-'
+            out.write('%-16s %10.3f %6.1f%% %10d %12s %s\n' % (name, secs, 100 * secs / total, self.calls[name],
+                                                             items if items else '-', rate))
+        for name, items in self.counts.items():
+            if name not in self.times:
+                out.write('%-16s %10s %7s %10s %12d %14s\n' % (name, '-', '-', '-', items, '-'))
+        out.write('%-16s %10.3f\n' % ('total', total))
+
+    @contextmanager
+    def session(self, profile=False, pstats_path=None, out=sys.stderr):
+        """
+        Profiles the block when enabled, and reports at the end
+        :param profile: enable the timers
+        :param pstats_path: path to dump the cProfile stats (can be read with pstats module); implies profile
+        :param out: stream for the report
+        """
+        if not profile and not pstats_path:
+            yield self
+            return
+        self.enable(pstats_path)
+        try:
+            yield self
+        finally:
+            self.disable(pstats_path)
+            self.report(out)
+            if pstats_path:
+                out.write('cProfile stats are at %s\n' % pstats_path)
+
+    @staticmethod
+    def add_argument(parser):
+        """Adds --profile and --pstats args to an argparse parser"""
+        parser.add_argument('--profile', action='store_true', default=False,
+                            help='Print the time taken by each stage')
+        parser.add_argument('--pstats', metavar='PATH', help='Profile with cProfile and dump the stats to this path.'
+                                                             ' Implies --profile')
+
+
+# shared by all the modules
+profiler = Profiler()
@@ -5,8 +5,8 @@ Useful metrics for evaluating predictions and gold answers
 import math
 from copy import copy
 import logging as log
-import numpy as np
-from scipy.spatial.distance import cosine
+from sink import Sink, STDOUT
+from instrument import profiler
 
 log.basicConfig(level=log.DEBUG)
 __author__ = 'Thamme Gowda'
@@ -26,6 +26,8 @@ class GloveCosine(object):
     Computes cosine similarity between terms using Glove vectors
     """
     def __init__(self, path, limit=None):
+        from scipy.spatial.distance import cosine   # imported here, the other metrics dont need scipy
+        self.cosine = cosine
         log.info("Reading Gloves from %s " % path)
         self.idx2tok, self.gloves = GloveCosine.read_gloves(path, limit)
         self.tok2idx = dict((tok, i) for i, tok in enumerate(self.idx2tok))
@@ -40,6 +42,7 @@ class GloveCosine(object):
 
     @staticmethod
     def read_gloves(path, limit=None):
+        import numpy as np
         vocab, vectors = [], []
         with open(path) as f:
             for line in f:
@@ -71,7 +74,7 @@ class GloveCosine(object):
             # if one of them is missing
             return 1.0 if word1 == word2 else 0.0
         else:
-            score = (1.0 - cosine(vec1, vec2))
+            score = (1.0 - self.cosine(vec1, vec2))
             return self.scaled_sigmoid(score)
 
 
@@ -116,22 +119,27 @@ def score_all(inp, outp, metric, delim='\t', multi_mode=False, single_score=Fals
 
     count = 0
     total = 0.0
+    lap = profiler.laps()
     for line in inp:
         words = line.split(delim)
         if len(words) != 2:
             log.warning("Skip: %s" % line)
             continue
         word1, word2 = words[0].strip(), words[1].strip()
+        lap('parse')
         if not multi_mode:
             score = metric(word1, word2)
         else:
             score = score_seqs(tokenize(word1), tokenize(word2), metric)
+        lap('score')
         total += score
         count += 1
         if not single_score:
             outp.write("%s%s%s%s%.4f\n" % (word1, delim, word2, delim, score))
+            lap(None)     # the records are only buffered, Sink times the writes
     if single_score:
         outp.write("%.4f" % (total / count))
+    profiler.count('score', count)
     log.info("Scored %d records" % count)
 
 
@@ -152,22 +160,26 @@ if __name__ == '__main__':
     # global parser arguments
     parser.add_argument('in', nargs='?', help='Input file to read records. Default is STDIN',
                         type=argparse.FileType('r'), default=sys.stdin)
-    parser.add_argument('out', nargs='?', help='Output file to write result. Default is STDOUT',
-                        type=argparse.FileType('w'), default=sys.stdout)
+    parser.add_argument('out', nargs='?', help='Output file to write result. Default is STDOUT.'
+                                               ' Compressed when the name ends with .gz or .zst', default=STDOUT)
     parser.add_argument('-mm', '--multi-mode', help='Multi word matching mode, uses spaces to split words,'
                                                     ' commas(,) to split synonyms and tabs to split columns',
                         action='store_true', default=False)
     parser.add_argument('-avg', '--average-score', help='Single score by computing the average of all records',
                         action='store_true', default=False)
+    profiler.add_argument(parser)
 
     args = vars(parser.parse_args())
-    if args['metric'] == 'strict':
-        metric = StrictMatch()
-    elif args['metric'] == 'glove':
-        metric = GloveCosine(args['model'], limit=args.get('vocab_size', None))
-    else:
-        raise Exception('Unknown metric %s' % args['metric'])
-    score_all(args['in'], args['out'], metric,
-              multi_mode=args['multi_mode'],
-              single_score=args['average_score'])
+    with profiler.session(args['profile'], args['pstats']):
+        with profiler.stage('load'):
+            if args['metric'] == 'strict':
+                metric = StrictMatch()
+            elif args['metric'] == 'glove':
+                metric = GloveCosine(args['model'], limit=args.get('vocab_size', None))
+            else:
+                raise Exception('Unknown metric %s' % args['metric'])
+        with Sink(args['out']) as out:
+            score_all(args['in'], out, metric,
+                      multi_mode=args['multi_mode'],
+                      single_score=args['average_score'])
 
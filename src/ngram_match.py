@@ -10,6 +10,9 @@ import sys
 from collections import Counter
 import math
 
+from sink import Sink, STDOUT
+from instrument import profiler
+
 
 def count_grams(seq, gram_size):
     return Counter(tuple(seq[i: i + gram_size]) for i in range(len(seq) + 1 - gram_size))
@@ -40,15 +43,21 @@ def match(hyp, ref, max_gram=4):
 
 
 def run(inp, ref, outp, max_gram=4, nocase=False):
-
+    lap = profiler.laps()
+    count = 0
     for hyp, ref in zip(inp, ref):
         if nocase:
             hyp = hyp.lower()
             ref = ref.lower()
 
         hyp, ref = hyp.split(), ref.split()
+        lap('parse')
         res = match(hyp, ref, max_gram)
+        lap('score')
         outp.write('%s\n' % '\t'.join(map(str, res)))
+        lap(None)     # the records are only buffered, Sink times the writes
+        count += 1
+    profiler.count('score', count)
 
 
 if __name__ == '__main__':
@@ -57,8 +66,10 @@ if __name__ == '__main__':
     p = argparse.ArgumentParser(description='Finds ngram overlap between records')
     p.add_argument('-i', '--in', help='Hypothesis input file', default=sys.stdin, type=argparse.FileType('r'))
     p.add_argument('-r', '--ref', help='Reference file', default=sys.stdin, type=argparse.FileType('r'))
-    p.add_argument('-o', '--out', help='Output file', default=sys.stdout, type=argparse.FileType('w'))
+    p.add_argument('-o', '--out', help='Output file. Compressed when the name ends with .gz or .zst', default=STDOUT)
     p.add_argument('-n', '--max-grams', help='Maximum N Grams match', default=4, type=int)
     p.add_argument('-lc', '--lower-case', help='ignore case', default=False, action='store_true')
+    profiler.add_argument(p)
     args = vars(p.parse_args())
-    run(args['in'], args['ref'], args['out'], args['max_grams'], args['lower_case'])
+    with profiler.session(args['profile'], args['pstats']), Sink(args['out']) as out:
+        run(args['in'], args['ref'], out, args['max_grams'], args['lower_case'])
@@ -5,11 +5,10 @@ Out of Vocabulary Translator
 """
 
 from collections import defaultdict
-from nltk.corpus import wordnet as wn
-import numpy as np
 import logging as log
 from pprint import pprint
-from giza import TTable
+from sink import Sink, STDOUT
+from instrument import profiler
 
 __author__ = 'Thamme Gowda'
 __date__ = 'October 6, 2017'
@@ -24,6 +23,7 @@ def get_synonyms(word):
     :param word: word whose synonyms are needed
     :return: set of synonyms
     """
+    from nltk.corpus import wordnet as wn     # slow to import, so only when needed
     word = word.lower()
     syns = set()
     for synset in wn.synsets(word):
@@ -42,6 +42,7 @@ def syn_matrix(words, strategy='direct'):
                         Possible scores: [0, 1, 2, ....]
     :return: table of n x n
     """
+    import numpy as np
     allowed = {'direct', 'transitive'}
     if strategy not in allowed:
         raise Exception("Allowed strategies: %s" % allowed)
@@ -112,7 +113,8 @@ class SuffixTranslator(OOVTranslator):
         ttab = self.ttab
         node, strip_suffix = ttab.longest_src_prefix(term=term)
         if len(strip_suffix) < 0.5 * len(term):  # not more than half -- FIXME: its a guess
-            neighbors = list(map(str, node.terminal_children()))
+            # words of the terminal nodes; the path of a node starts with the name of root
+            neighbors = [kid.get_path()[1:] for kid in node.terminal_children()]
             if neighbors:
                 neighbors = set(neighbors)
                 # step: get candidate probabilities and candidate in degree
@@ -231,17 +233,28 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-t', '--ttab', required=True, help='Translation Table path')
     parser.add_argument('-in', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
-    parser.add_argument('-out', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+    parser.add_argument('-out', nargs='?', default=STDOUT,
+                        help='Output file. Default is STDOUT. Compressed when the name ends with .gz or .zst')
+    profiler.add_argument(parser)
     args = vars(parser.parse_args())
-    ttab = TTable.load_from(args['ttab'])
-    words = list(read_column(args['in'], delim='\t'))
-    trans = SuffixTranslator(ttab)
-    out = args['out']
-    count =0
-    for f_w in words:
-        res = trans.translate(f_w.lower())
-        res = get_best(res)
-        out.write("%s\t%s\n" % (f_w, res))
-        count += 1
+    from giza import TTable
+    with profiler.session(args['profile'], args['pstats']):
+        ttab = TTable.load_from(args['ttab'])     # timed as 'load'
+        with profiler.stage('parse'):
+            words = list(read_column(args['in'], delim='\t'))
+        trans = SuffixTranslator(ttab)
+        count = 0
+        with Sink(args['out']) as out:
+            lap = profiler.laps()
+            for f_w in words:
+                res = trans.translate(f_w.lower())    # prefix lookup and scoring of the candidates
+                lap('translate')
+                res = get_best(res)
+                lap('select')
+                out.write("%s\t%s\n" % (f_w, res))
+                lap(None)     # the records are only buffered, Sink times the writes
+                count += 1
+        for name in ('parse', 'translate', 'select'):
+            profiler.count(name, count)
     log.info("Translated %d words" % count)
 
@@ -8,12 +8,14 @@ from argparse import ArgumentParser
 
 from other import oromo_stemmer
 from solr import Solr
+from instrument import profiler
 
 log.basicConfig(level=log.INFO)
 
 
+@profiler.timed('stem')
 def stem(word):
-    return oromo_stemmer.oromo_stem_line(word, oromo_stemmer.ulf_pttrn2, oromo_stemmer.trim_pttrn)
+    return oromo_stemmer.stemmers['ulf2'].stem_line(word, trim=True)
 
 
 class NameFinder(object):
@@ -54,10 +56,12 @@ class NameFinder(object):
                     results = [(r['name'], r['score']) for r in results]
                     print('%s --> %s' % (tok, results))
 
+    @profiler.timed('lookup')
     def lookup(self, word):
         is_new = False
         if word not in self.cache:
-            res = solr.get_top("name_bmpm_s:\"%s\"" % word, rows=5, fl='name,score', sort='score desc,len asc')
+            profiler.count('lookup')
+            res = self.solr.get_top("name_bmpm_s:\"%s\"" % word, rows=5, fl='name,score', sort='score desc,len asc')
             results = None
             if res and res['numFound'] > 0:
                 results = res['docs']
@@ -65,6 +69,7 @@ class NameFinder(object):
             is_new = True
         return self.cache[word], is_new
 
+    @profiler.timed('parse')
     def scan_names(self, line):
         toks = line.split()
         groups = []   # group based on title case token groups
@@ -86,16 +91,18 @@ def catch_names(path, finder):
         for line in f:
             line = line.strip()
             groups = finder.scan_names(line)
+            profiler.count('parse')
             for group in groups:
                 finder.beam(group)
 
 
 if __name__ == '__main__':
-    sys.argv = ['', '-in', '../data/set1.source.tok', '-solr', 'http://localhost:8983/solr/name']
     p = ArgumentParser()
     p.add_argument("-in", required=True, help="Input File.")
     p.add_argument("-solr", required=True, help="Solr URL. Eg:http://localhost:8983/solr/name")
+    profiler.add_argument(p)
     args = vars(p.parse_args())
-    solr = Solr(args['solr'])
-    finder = NameFinder(solr, stem_func=stem)
-    catch_names(args['in'], finder)
\ No newline at end of file
+    with profiler.session(args['profile'], args['pstats']):
+        solr = Solr(args['solr'])
+        finder = NameFinder(solr, stem_func=stem)
+        catch_names(args['in'], finder)
\ No newline at end of file
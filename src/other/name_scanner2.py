@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
+"""
+Mines transliterations of English names from a parallel corpus.
+
+An inverted index from english name to sentence ids is built once, so that
+only the sentences having a name are scanned for its foreign matches.
+"""
 
 import sys
+from collections import defaultdict
+from multiprocessing import Pool
 
 from other.name_scanner import *
 
@@ -9,34 +17,87 @@ def printerr(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
-parser = ArgumentParser()
-parser.add_argument('-n', help='File having english name tokens.', required=True)
-parser.add_argument('-e', help='Source file', required=True)
-parser.add_argument('-f', help='Target file', required=True)
-parser.add_argument('-strict', help='Strict match Sounds only. reduces false possitives', action='store_true', default=False)
-parser.add_argument('-verbose', help='Verbose', action='store_true', default=False)
-args = vars(parser.parse_args())
-names = read_file(args['n'])
+def build_index(es, names):
+    """
+    Builds an inverted index of names to sentences
+    :param es: tokenized english sentences
+    :param names: set of names to be indexed
+    :return: dict of name -> list of sentence ids
+    """
+    index = defaultdict(list)
+    for sent_id, ets in enumerate(es):
+        for name in set(ets) & names:
+            index[name].append(sent_id)
+    return index
 
-pats = compile_patterns(names, False, True, args['strict'])
 
-es = [line.lower().split() for line in read_file(args['e'])] # english
-fs = [line.lower().split() for line in read_file(args['f'])] # foreign
-assert len(es) == len(fs)
+# state of the worker processes, shared via fork or initializer
+_state = {}
 
-names = set(names)
-verbose = args['verbose']
 
-for k,v in pats.items():
-    for ets, fts in zip(es, fs):
-        missed = []
-        for name in set(ets) & names:
-            res = list(lookup(fts, pats[name]))
-            if res:
-                for r in res:
-                    print("%s\t%s" % (name, r))
-            else:
-                missed.append(name)
-
-        if missed and verbose:
-            printerr(">> MISSED %s  :: %s" % (missed, fts))
+def _init_worker(fs, pats):
+    _state['fs'] = fs
+    _state['pats'] = pats
+
+
+def scan_name(job):
+    """
+    Scans the foreign sentences of a name for its matches
+    :param job: (name, sentence_ids)
+    :return: name, list of matches, list of sentence ids which had no matches
+    """
+    name, sent_ids = job
+    fs, pattern = _state['fs'], _state['pats'][name]
+    found, missed = [], []
+    for sent_id in sent_ids:
+        res = list(lookup(fs[sent_id], pattern))
+        if res:
+            found.extend(res)
+        else:
+            missed.append(sent_id)
+    return name, found, missed
+
+
+def mine_names(es, fs, names, strict=False, workers=1):
+    """
+    Mines the name matches from parallel sentences
+    :param es: tokenized english sentences
+    :param fs: tokenized foreign sentences
+    :param names: english names
+    :param strict: strict match sounds
+    :param workers: number of worker processes
+    :return: stream of (name, matches, missed sentence ids)
+    """
+    assert len(es) == len(fs)
+    names = set(names)
+    pats = compile_patterns(names, False, True, strict)
+    index = build_index(es, names)
+    jobs = sorted(index.items())
+    if workers > 1:
+        with Pool(workers, initializer=_init_worker, initargs=(fs, pats)) as pool:
+            yield from pool.imap(scan_name, jobs, chunksize=max(1, len(jobs) // (workers * 16)))
+    else:
+        _init_worker(fs, pats)
+        yield from map(scan_name, jobs)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-n', help='File having english name tokens.', required=True)
+    parser.add_argument('-e', help='Source file', required=True)
+    parser.add_argument('-f', help='Target file', required=True)
+    parser.add_argument('-strict', help='Strict match Sounds only. reduces false possitives', action='store_true', default=False)
+    parser.add_argument('-verbose', help='Verbose', action='store_true', default=False)
+    parser.add_argument('-workers', help='Number of worker processes', type=int, default=1)
+    args = vars(parser.parse_args())
+    names = read_file(args['n'])
+
+    es = [line.lower().split() for line in read_file(args['e'])]  # english
+    fs = [line.lower().split() for line in read_file(args['f'])]  # foreign
+
+    for name, found, missed in mine_names(es, fs, names, args['strict'], args['workers']):
+        for r in found:
+            print("%s\t%s" % (name, r))
+        if missed and args['verbose']:
+            for sent_id in missed:
+                printerr(">> MISSED %s  :: %s" % (name, fs[sent_id]))
@@ -11,10 +11,14 @@ import sys
 from argparse import ArgumentParser
 import codecs
 import re
+from functools import lru_cache
+
+from parallel import run_stdio
 
 
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
-patterns = [r"([{0}{1}])[{0}{1}]+" .format(ch.upper(), ch) for ch in alphabet]
+# a latin letter repeated, in any case. re.ASCII : dont match non latin letters case-insensitively (e.g. Kelvin sign)
+pattern = re.compile(r"([a-z])\1+", re.IGNORECASE | re.ASCII)
 replacement_pattern = r'\1'   # the first character in whichever the case it appears
 
 
@@ -37,15 +41,14 @@ def read_tokens(path, tokenize=True):
     return tokens
 
 
+@lru_cache(maxsize=1 << 18)
 def normalize_word(word):
     """
     Normalizes a word by replacing repeated characters
     :param word:
     :return:
     """
-    for p in patterns:
-        word = re.sub(p, replacement_pattern, word)
-    return word
+    return pattern.sub(replacement_pattern, word)
 
 
 def is_copyme(word):
@@ -62,17 +65,23 @@ def is_copyme(word):
         return True
 
 
-def normalize_stdio(copy_me_tokens, ignore_case=False):
+_state = {}
+
+
+def _init_state(copy_me_tokens, ignore_case):
+    _state['copy_me_tokens'] = copy_me_tokens
+    _state['ignore_case'] = ignore_case
+
+
+def normalize_lines(lines):
     """
-    Normalizes the text in standard input and writes it to standard output
-    :param copy_me_tokens:  set of tokens which should be copied
-    :param ignore_case:  should the lookup of tokens in copy_me set be case insensitive?
-    :return: None, everything goes to STDOUT
+    Normalizes lines, using the state set by _init_state()
+    :param lines: list of lines
+    :return: list of normalized lines
     """
-    if ignore_case:
-        copy_me_tokens = set([tok.lower() for tok in copy_me_tokens])
-    for line in sys.stdin:
-        line = line.strip()
+    copy_me_tokens, ignore_case = _state['copy_me_tokens'], _state['ignore_case']
+    out_lines = []
+    for line in lines:
         result = []
         for tok in line.split():
             lookup_tok = tok.lower() if ignore_case else tok
@@ -80,8 +89,22 @@ def normalize_stdio(copy_me_tokens, ignore_case=False):
                 result.append(tok)
             else:
                 result.append(normalize_word(tok))
-        out_line = ' '.join(result)
-        print(out_line)
+        out_lines.append(' '.join(result))
+    return out_lines
+
+
+def normalize_stdio(copy_me_tokens, ignore_case=False, workers=1):
+    """
+    Normalizes the text in standard input and writes it to standard output
+    :param copy_me_tokens:  set of tokens which should be copied
+    :param ignore_case:  should the lookup of tokens in copy_me set be case insensitive?
+    :param workers: number of worker processes
+    :return: None, everything goes to STDOUT
+    """
+    if ignore_case:
+        copy_me_tokens = set([tok.lower() for tok in copy_me_tokens])
+    run_stdio(normalize_lines, workers=workers, initializer=_init_state, initargs=(copy_me_tokens, ignore_case))
+
 
 if __name__ == '__main__':
     parser = ArgumentParser(description='Oromo Script normalizer')
@@ -89,6 +112,7 @@ if __name__ == '__main__':
     parser.add_argument('-t', '--tokenize', help='Tokenize english Vocabulary', action='store_true', default=False)
     parser.add_argument('-i', '--ignore-case', help='Ignore case while looking up the tokens in vocabulary',
                         action='store_true', default=False)
+    parser.add_argument('-w', '--workers', help='Number of worker processes', type=int, default=1)
     args = vars(parser.parse_args())
     tokens = read_tokens(args['vocab'], args['tokenize'])
-    normalize_stdio(tokens, args['ignore_case'])
\ No newline at end of file
+    normalize_stdio(tokens, args['ignore_case'], args['workers'])
\ No newline at end of file
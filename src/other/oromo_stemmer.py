@@ -6,15 +6,22 @@ Date = August 16, 2017
 Version 0.1
 """
 
-import sys
 import re
 from argparse import ArgumentParser
+from functools import partial, lru_cache
 
+from ds import Trie
+from parallel import run_stdio
 
-tg_pttrn = r'(\w{3})(eessuu|eessaa|eessa|ummaa|nnoo|mmaa|tti|ssa|aan|iin|suu|ama|cha|uuf|uun|nni|oo|ee|uu|ii|aa)(\s|$)'
-ulf_pttrn1 = r'(\w{3})(oota|otii|tiin|onni|icha|tichi|chi|ttin|tti|era|jira|tokko|tiif)(\s|$)'
-ulf_pttrn2 = r'(\w{3})(oota|ootan|ootaa|ootaan|ota|ttin|otii|onnii|onni|wwan|chi|ichi|tichi|ttin|tti' \
-            r'|era|eera|jira|iiru|etti|n|ne|f|fe|tiin|cha|chaaf|ummaa|aatii|tiif)(\s|$)'
+
+tg_suffixes = 'eessuu|eessaa|eessa|ummaa|nnoo|mmaa|tti|ssa|aan|iin|suu|ama|cha|uuf|uun|nni|oo|ee|uu|ii|aa'.split('|')
+ulf_suffixes1 = 'oota|otii|tiin|onni|icha|tichi|chi|ttin|tti|era|jira|tokko|tiif'.split('|')
+ulf_suffixes2 = ('oota|ootan|ootaa|ootaan|ota|ttin|otii|onnii|onni|wwan|chi|ichi|tichi|ttin|tti'
+                 '|era|eera|jira|iiru|etti|n|ne|f|fe|tiin|cha|chaaf|ummaa|aatii|tiif').split('|')
+
+tg_pttrn = r'(\w{3})(%s)(\s|$)' % '|'.join(tg_suffixes)
+ulf_pttrn1 = r'(\w{3})(%s)(\s|$)' % '|'.join(ulf_suffixes1)
+ulf_pttrn2 = r'(\w{3})(%s)(\s|$)' % '|'.join(ulf_suffixes2)
 split_pttrn = r'\1 -\2\3'
 trim_pttrn = r'\1\3'
 
@@ -27,17 +34,71 @@ def oromo_stem_line(line, ptrn=ulf_pttrn2, rplmt=split_pttrn):
     return re.sub(ptrn, rplmt, line)
 
 
-def oromo_stem(ptrn, rplmt):
-    for line in sys.stdin:
-        line = oromo_stem_line(line, ptrn, rplmt)
-        print(line.strip())
+class SuffixStemmer(object):
+    """
+    Token level stemmer, equivalent to applying the (\\w{3})(suffix1|suffix2...)(\\s|$) patterns on lines.
+    The regex strips the longest suffix which leaves a stem ending in 3 word chars;
+     here the suffixes are matched longest first on a trie of reversed suffixes, and the results are memoized.
+    """
+    ws_split = re.compile(r'(\s+)').split
+    is_word3 = re.compile(r'\w{3}').fullmatch
+
+    def __init__(self, suffixes, min_stem=3, cache_size=1 << 18):
+        self.suffix_trie = Trie.build(set(s[::-1] for s in suffixes))
+        self.min_stem = min_stem
+        assert min_stem == 3, 'Only 3 char stem constraint is supported (because the patterns use \\w{3})'
+        # separate caches for split and trim, single argument caches are the fastest
+        self._split = lru_cache(maxsize=cache_size)(partial(self._stem, trim=False))
+        self._trim = lru_cache(maxsize=cache_size)(partial(self._stem, trim=True))
+
+    def stem(self, token, trim=False):
+        return self._trim(token) if trim else self._split(token)
+
+    def _stem(self, token, trim=False):
+        """
+        :param token: a token, usually without white spaces
+        :param trim: trim the suffix, else split it as 'stem -suffix'
+        :return: stemmed token
+        """
+        if token.split() != [token]:
+            if not token:
+                return token
+            # has other white spaces (tabs, new lines); stem the parts, keep the spaces
+            parts = self.ws_split(token)
+            parts[::2] = (self._stem(part, trim) for part in parts[::2])
+            return ''.join(parts)
+        nodes, _ = self.suffix_trie.path(token[::-1])
+        for size in range(len(nodes), 0, -1):       # longest first
+            if nodes[size - 1].is_term:
+                cut = len(token) - size
+                if cut >= self.min_stem and self.is_word3(token[cut - self.min_stem: cut]):
+                    return token[:cut] if trim else '%s -%s' % (token[:cut], token[cut:])
+        return token
+
+    def stem_line(self, line, trim=False):
+        # splitting at spaces is a lot faster than regex; the tokens having other white spaces are handled in _stem
+        return ' '.join(map(self._trim if trim else self._split, line.split(' ')))
+
+
+stemmers = {'tg': SuffixStemmer(tg_suffixes),
+            'ulf1': SuffixStemmer(ulf_suffixes1),
+            'ulf2': SuffixStemmer(ulf_suffixes2)}
+
+
+def stem_lines(lines, name, trim):
+    stemmer = stemmers[name]
+    return [stemmer.stem_line(line, trim).strip() for line in lines]
+
+
+def oromo_stem(name, trim, workers=1):
+    run_stdio(partial(stem_lines, name=name, trim=trim), workers=workers)
 
 
 if __name__ == '__main__':
     p = ArgumentParser()
     p.add_argument('-p', '--pattern', help='Name of pattern: tg, ulf1, ulf2', default='ulf2')
     p.add_argument('-t', '--trim', help='Trim suffixes', action='store_true')
+    p.add_argument('-w', '--workers', help='Number of worker processes', type=int, default=1)
     args = vars(p.parse_args())
-    ptrn = patterns[args['pattern']]
-    rplmt = trim_pttrn if args['trim'] else split_pttrn
-    oromo_stem(ptrn, rplmt)
\ No newline at end of file
+    assert args['pattern'] in stemmers, 'Unknown pattern %s' % args['pattern']
+    oromo_stem(args['pattern'], args['trim'], args['workers'])
\ No newline at end of file
@@ -1,7 +1,14 @@
 from argparse import ArgumentParser
+from collections import Counter
+from multiprocessing import Pool
+import re
 import sys
 
+from parallel import file_shards, read_shard
+
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
+# a doubled letter. non overlapping, left to right : same as str.replace(char+char, char) for each char
+double_pattern = re.compile(r'([%s])\1' % alphabet)
 
 
 def read_file(path, delim='\t'):
@@ -9,6 +16,16 @@ def read_file(path, delim='\t'):
         return [line.strip().split(delim) for line in f]
 
 
+def read_records(lines, delim='\t'):
+    """
+    Streams records from lines
+    :param lines: stream of lines
+    :param delim: delimiter
+    :return: stream of records
+    """
+    return (line.strip().split(delim) for line in lines)
+
+
 def find_suffix(word1, word2):
     last = -1
     for i in range(min(len(word1), len(word2))):
@@ -22,24 +39,84 @@ def find_suffix(word1, word2):
 
 
 def normalize_sounds(word):
-    for char in alphabet:
-        word = word.replace(char+char, char)
-    return word
+    return double_pattern.sub(r'\1', word)
 
 
-def mine_suffixes(recs):
-    recs = (rec for rec in recs if len(rec) == 2)
-    recs = ((normalize_sounds(rec[0]), normalize_sounds(rec[1])) for rec in recs)
-    for lemma, inflection in recs:
-        root, suf1, suf2 = find_suffix(lemma, inflection)
+def iter_suffixes(recs):
+    """
+    :param recs: stream of (lemma, inflection) records
+    :return: stream of (root, lemma_suffix, inflection_suffix)
+    """
+    for rec in recs:
+        if len(rec) != 2:
+            continue
+        root, suf1, suf2 = find_suffix(normalize_sounds(rec[0]), normalize_sounds(rec[1]))
         if root and (suf1 or suf2):
-            print("%s\t%s\t%s" % (root, suf1, suf2))
+            yield root, suf1, suf2
+
+
+def mine_suffixes(recs):
+    for root, suf1, suf2 in iter_suffixes(recs):
+        print("%s\t%s\t%s" % (root, suf1, suf2))
+
+
+def count_suffixes(recs):
+    """
+    Aggregates the suffix pairs
+    :param recs: stream of (lemma, inflection) records
+    :return: Counter of (lemma_suffix, inflection_suffix)
+    """
+    return Counter((suf1, suf2) for _, suf1, suf2 in iter_suffixes(recs))
+
+
+def _count_shard(shard):
+    return count_suffixes(read_records(read_shard(*shard)))
+
+
+def count_file(path, workers=1, shard_size=32 * 1024 * 1024):
+    """
+    Counts suffix pairs in a file, the shards of file are counted in parallel and then merged
+    :param path: path to file having "lemma\tinflection" records
+    :param workers: number of worker processes
+    :param shard_size: approximate size of a shard in bytes
+    :return: Counter of (lemma_suffix, inflection_suffix)
+    """
+    if workers <= 1:
+        with open(path) as f:
+            return count_suffixes(read_records(f))
+    total = Counter()
+    with Pool(workers) as pool:
+        for counts in pool.imap_unordered(_count_shard, file_shards(path, shard_size)):
+            total.update(counts)
+    return total
+
+
+def write_table(counts, out, min_count=1):
+    """
+    Writes suffix pairs ranked by their frequency
+    :param counts: Counter of suffix pairs
+    :param out: output stream
+    :param min_count: skip the pairs seen less than this
+    :return:
+    """
+    # ties are broken by the suffixes, so that the table doesnt depend on the order of merging shards
+    for (suf1, suf2), count in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+        if count < min_count:
+            break
+        out.write("%s\t%s\t%d\n" % (suf1, suf2, count))
 
 
 if __name__ == '__main__':
-    sys.argv = ['', '-i', '/Users/tg/work/isi/oov/workspace/oromo-oov/oromo-lemmas.tsv']
     parser = ArgumentParser()
     parser.add_argument('-i', help='File having "lemma\tinflection"', required=True)
+    parser.add_argument('-raw', help='Print the (root, suffix1, suffix2) of each record, without aggregation',
+                        action='store_true', default=False)
+    parser.add_argument('-workers', help='Number of worker processes', type=int, default=1)
+    parser.add_argument('-min', help='Minimum count of a suffix pair', type=int, default=1)
     args = vars(parser.parse_args())
-    recs = read_file(args['i'])
-    mine_suffixes(recs)
+    if args['raw']:
+        with open(args['i']) as f:
+            mine_suffixes(read_records(f))
+    else:
+        counts = count_file(args['i'], workers=args['workers'])
+        write_table(counts, sys.stdout, min_count=args['min'])
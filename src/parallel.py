@@ -0,0 +1,109 @@
+"""
+Helpers for processing large inputs on many cores, with results in the order of inputs.
+
+"""
+import os
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+
+from sink import Sink, STDOUT
+
+__version__ = '0.1'
+
+
+def read_blocks(lines, block_size=10000):
+    """
+    Groups a stream of lines into blocks
+    :param lines: stream of lines
+    :param block_size: number of lines in a block
+    :return: stream of lists of lines
+    """
+    lines = iter(lines)
+    while True:
+        block = list(islice(lines, block_size))
+        if not block:
+            break
+        yield block
+
+
+def file_shards(path, shard_size):
+    """
+    Cuts a file into byte ranges
+    :param path: file path
+    :param shard_size: size of each shard in bytes
+    :return: list of (path, start, end)
+    """
+    size = os.path.getsize(path)
+    return [(path, start, min(start + shard_size, size)) for start in range(0, size, shard_size)]
+
+
+def read_shard(path, start, end):
+    """
+    Reads lines in the byte range. A line belongs to the shard in which it starts.
+    :return: stream of lines
+    """
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()        # skip to the beginning of the next line
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode('utf-8')
+
+
+def ordered_map(func, items, workers=None, initializer=None, initargs=(), max_pending=None):
+    """
+    Maps func over items using a pool of processes, and yields the results in the same order as items.
+    Only max_pending items are in flight at a time; results finished ahead of their turn
+    wait in a reorder buffer, so the memory is bounded even when items is a large stream.
+    :param func: function to map, must be picklable (i.e. a module level function)
+    :param items: stream of items
+    :param workers: number of worker processes; default is number of CPUs. When 1, runs in this process.
+    :param initializer: called once in each worker, say to load a model
+    :param initargs: args to initializer
+    :param max_pending: maximum number of items in flight, default is 4 x workers
+    :return: stream of results
+    """
+    workers = workers or cpu_count()
+    if workers <= 1:
+        if initializer:
+            initializer(*initargs)
+        yield from map(func, items)
+        return
+    max_pending = max_pending or 4 * workers
+    with Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        buffer = deque()
+        for item in items:
+            if len(buffer) >= max_pending:
+                yield buffer.popleft().get()
+            buffer.append(pool.apply_async(func, (item,)))
+        while buffer:
+            yield buffer.popleft().get()
+
+
+def run_stdio(func, workers=1, block_size=10000, initializer=None, initargs=(), inp=None, out=STDOUT):
+    """
+    Runs func over blocks of lines of the input, writes the results in the same order to output.
+    :param func: function that maps a list of lines to a list of output lines (without new lines).
+      it must be picklable (i.e. a module level function)
+    :param workers: number of worker processes
+    :param block_size: number of lines in a block
+    :param initializer: called once in each worker
+    :param initargs: args to initializer
+    :param inp: input lines, default is STDIN
+    :param out: output path, default is STDOUT
+    :return: number of lines written
+    """
+    inp = sys.stdin if inp is None else inp
+    count = 0
+    with Sink(out) as sink:
+        for res in ordered_map(func, read_blocks(inp, block_size), workers=workers,
+                               initializer=initializer, initargs=initargs):
+            count += len(res)
+            for line in res:
+                sink.writeline(line)
+    return count
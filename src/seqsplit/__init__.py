@@ -1,6 +1,14 @@
-
 from abc import abstractmethod, ABC
+from array import array
+from collections.abc import Mapping
+from functools import lru_cache
+from itertools import accumulate
+import importlib
+import json
+import mmap
 import pickle
+import struct
+import sys
 import logging as log
 
 __author__ = 'Thamme Gowda'
@@ -9,8 +17,218 @@ __version__ = '0.1'
 log.basicConfig(level=log.INFO)
 
 
+class StringTable(object):
+    """
+    Read only table of strings over the utf-8 bytes in a model file; the strings are decoded on access
+    """
+    def __init__(self, data, offsets):
+        """
+        :param data: bytes of all strings concatenated
+        :param offsets: start of each string in data, the last one is the end
+        """
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, idx):
+        """
+        :return: utf-8 bytes of the string at idx
+        """
+        return bytes(self.data[self.offsets[idx]: self.offsets[idx + 1]])
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self.raw(idx).decode('utf-8')
+
+
+class CountsView(Mapping):
+    """
+    Read only mapping of strings to counts, served from the arrays of a model file without copying them.
+    The keys are ids in the string table sorted by their strings, so a lookup is a binary search.
+    UTF-8 bytes sort in the same order as the python strings, so the search compares the raw bytes.
+    """
+    def __init__(self, strings, keys, counts):
+        """
+        :param strings: StringTable
+        :param keys: string ids, sorted by the strings
+        :param counts: counts, aligned with keys
+        """
+        assert len(keys) == len(counts)
+        self.strings = strings
+        self.keys_ = keys
+        self.counts = counts
+
+    def _find(self, key):
+        """
+        :return: index of key, -1 when it is missing
+        """
+        if not isinstance(key, str):
+            return -1
+        target = key.encode('utf-8')
+        data, offsets, keys = self.strings.data, self.strings.offsets, self.keys_
+        lo, hi = 0, len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = keys[mid]
+            if data[offsets[k]: offsets[k + 1]].tobytes() < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(keys) and self.strings.raw(keys[lo]) == target else -1
+
+    def __getitem__(self, key):
+        idx = self._find(key)
+        if idx < 0:
+            raise KeyError(key)
+        return self.counts[idx]
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        strings = self.strings
+        return (strings[k] for k in self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+    def items(self):
+        return zip(iter(self), self.counts)
+
+    def positive(self, cache_size=1 << 16):
+        """
+        :param cache_size: number of recent lookups to cache
+        :return: set like view of the keys having positive counts
+        """
+        return PositiveKeys(self, cache_size)
+
+
+class PositiveKeys(object):
+    """
+    Keys of a CountsView having positive counts, supports only the `in` checks.
+    The recent lookups are cached, since the frequent tokens are looked up again and again
+    """
+
+    def __init__(self, counts, cache_size=1 << 16):
+        self.counts = counts
+        self._contains = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, key):
+        idx = self.counts._find(key)
+        return idx >= 0 and self.counts.counts[idx] > 0
+
+    def __contains__(self, key):
+        return self._contains(key)
+
+
+class ModelFile(object):
+    """
+    Compact binary model format, loaded via mmap without unpickling.
+    Layout:
+        MAGIC (8 bytes), header length (uint32), JSON header, sections (8 byte aligned)
+    The header has the model metadata and (offset, size, typecode) of the sections.
+    Sections are:
+        strings        : an interned string table, utf-8 bytes of the strings concatenated
+        string_offsets : start of each string in the strings section, and the end
+        <arrays>       : named integer arrays, typecodes as in array module; they are read as memoryviews
+    The sections are not copied on load; the pages of the mmaped file are shared by the processes loading it.
+    """
+    MAGIC = b'SSPLITv\x00'
+    FORMAT_VERSION = 1
+
+    @staticmethod
+    def write(path, meta, strings, arrays):
+        """
+        :param path: file path
+        :param meta: JSON-able dict of metadata
+        :param strings: list of strings
+        :param arrays: dict of name -> array.array
+        :return:
+        """
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = ModelFile.int_array(accumulate(map(len, encoded), initial=0))
+        blobs = [('strings', 'B', b''.join(encoded)), ('string_offsets', offsets.typecode, offsets.tobytes())]
+        blobs += [(name, arr.typecode, arr.tobytes()) for name, arr in arrays.items()]
+        sections, offset = {}, 0
+        for name, typecode, blob in blobs:
+            sections[name] = {'offset': offset, 'size': len(blob), 'typecode': typecode}
+            offset += len(blob) + (-len(blob) % 8)
+        header = dict(meta, format_version=ModelFile.FORMAT_VERSION, byteorder=sys.byteorder,
+                      num_strings=len(strings), sections=sections)
+        header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        header += b' ' * (-(len(ModelFile.MAGIC) + 4 + len(header)) % 8)
+        with open(path, 'wb') as out:
+            out.write(ModelFile.MAGIC)
+            out.write(struct.pack('<I', len(header)))
+            out.write(header)
+            for name, typecode, blob in blobs:
+                out.write(blob)
+                out.write(b'\x00' * (-len(blob) % 8))
+
+    @staticmethod
+    def int_array(values):
+        """
+        :param values: integers
+        :return: array of the smallest integer type which can hold all the values
+        """
+        values = array('q', values)
+        lo, hi = (min(values), max(values)) if values else (0, 0)
+        for typecode in 'bhi':
+            limit = 1 << (8 * array(typecode).itemsize - 1)
+            if -limit <= lo and hi < limit:
+                return array(typecode, values)
+        return values
+
+    @staticmethod
+    def is_model_file(path):
+        with open(path, 'rb') as f:
+            return f.read(len(ModelFile.MAGIC)) == ModelFile.MAGIC
+
+    @staticmethod
+    def read(path):
+        """
+        :param path: file path
+        :return: meta, strings (StringTable), arrays (read only memoryviews over the mmaped file)
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buf)
+        start = len(ModelFile.MAGIC)
+        assert bytes(view[:start]) == ModelFile.MAGIC, '%s is not a model file' % path
+        header_len, = struct.unpack('<I', view[start: start + 4])
+        start += 4
+        meta = json.loads(bytes(view[start: start + header_len]).decode('utf-8'))
+        start += header_len
+        if meta['format_version'] > ModelFile.FORMAT_VERSION:
+            raise Exception('Model format %s is newer than supported %s' %
+                            (meta['format_version'], ModelFile.FORMAT_VERSION))
+        if meta['byteorder'] != sys.byteorder:
+            raise Exception('Model is stored in %s endian, but this machine is %s endian'
+                            % (meta['byteorder'], sys.byteorder))
+        arrays = {}
+        for name, sec in meta['sections'].items():
+            arrays[name] = view[start + sec['offset']: start + sec['offset'] + sec['size']].cast(sec['typecode'])
+        strings = StringTable(arrays.pop('strings'), arrays.pop('string_offsets'))
+        assert len(strings) == meta['num_strings']
+        return meta, strings, arrays
+
+
 class SeqSplitter(ABC):
 
+    # class name -> class, for loading the models stored in compact format.
+    # Only the classes implementing both to_compact() and from_compact() are registered
+    registry = {}
+    # modules to import for finding the classes which are not yet registered
+    known_modules = {'TerminalSplitter': 'seqsplit.terminal_rule'}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.to_compact is not SeqSplitter.to_compact and hasattr(cls, 'from_compact'):
+            SeqSplitter.registry[cls.__name__] = cls
+
     @abstractmethod
     def learn(self, seqs):
         pass
@@ -25,13 +243,36 @@ class SeqSplitter(ABC):
     def detokenize(self, seq):
         return ' '.join(seq)
 
+    def to_compact(self):
+        """
+        Subclasses supporting compact model format should return (meta, strings, arrays), see ModelFile,
+         and implement the classmethod from_compact(meta, strings, arrays) for loading them
+        """
+        return None
+
     def save(self, path):
         log.info("Saving the model %s at %s" % (type(self), path))
-        pickle.dump(self, open(path, 'wb'))
+        compact = self.to_compact()
+        if compact:
+            meta, strings, arrays = compact
+            ModelFile.write(path, dict(meta, cls=type(self).__name__), strings, arrays)
+        else:
+            pickle.dump(self, open(path, 'wb'))
 
     @staticmethod
     def load(path):
         log.info("Loading model from %s " % path)
+        if ModelFile.is_model_file(path):
+            meta, strings, arrays = ModelFile.read(path)
+            name = meta['cls']
+            if name not in SeqSplitter.registry and name in SeqSplitter.known_modules:
+                importlib.import_module(SeqSplitter.known_modules[name])
+            if name not in SeqSplitter.registry:
+                raise Exception('%s does not support the compact model format' % name)
+            self = SeqSplitter.registry[name].from_compact(meta, strings, arrays)
+            assert isinstance(self, SeqSplitter)
+            return self
+        # older models are pickled
         with open(path, 'rb') as f:
             self = pickle.load(f)
             assert isinstance(self, SeqSplitter)
@@ -11,6 +11,9 @@ Created : Nov 30, 2017
 
 import sys
 import logging as log
+from array import array
+from itertools import islice
+import numpy as np
 from seqsplit import SeqSplitter
 from seqsplit.terminal_rule import TerminalSplitter
 
@@ -20,142 +23,289 @@ log.basicConfig(level=log.INFO)
 def tag_line_breaks(records, tokenizer=None):
     """
     Tags all the tokens in records as one stream.
-    It marks line endings as '1' others as 0
+    It marks line endings as 1 others as 0
     :param records:
     :param tokenizer: tokenizer to be used, default is whitespace tokenizer
-    :return: stream of tokens with 0 for inside tokens and 1 for sentence endings
+    :return: tokens (interned), labels as int8 array with 0 for inside tokens and 1 for sentence endings
     """
+    tokens, labels = [], array('b')
+    intern = sys.intern
     for rec in records:
         toks = tokenizer(rec) if tokenizer else rec.strip().split()
         assert toks
-        yield from ((t, 1 if i == len(toks) - 1 else 0) for i, t in enumerate(toks))
+        tokens.extend(map(intern, toks))
+        labels.frombytes(bytes(len(toks) - 1))
+        labels.append(1)
+    return tokens, labels
 
 
-def fix_tokenization(src, ref):
+def tag_chunks(records, tokenizer=None, chunk_size=10000):
     """
-    A quick fix for extra tokenizations in references.
-    :param src:
-    :param ref:
-    :return: source, reference , after aligning the tokens
+    Tags the records in chunks, so that a large file is not held in memory; see tag_line_breaks()
+    :param records: stream of records
+    :param tokenizer: tokenizer to be used, default is whitespace tokenizer
+    :param chunk_size: number of records per chunk
+    :return: stream of (tokens, labels)
     """
+    records = iter(records)
+    while True:
+        chunk = tag_line_breaks(islice(records, chunk_size), tokenizer=tokenizer)
+        if not chunk[0]:
+            break
+        yield chunk
+
 
-    def aligner(token, seq, idx):
-        # Reference may vae split this source word into many parts
-        buf = seq[idx][0]
-        k = idx
-        while buf != token and len(buf) < len(token) and k < len(seq):
-            k += 1
-            buf += seq[k][0]
-        return k if buf == token else -1
-    src_res, ref_res = [], []
-    i, j = 0, 0
-    while i < len(src) and j < len(ref):
-        left, right = src[i], ref[j]
-        error = src[i][0] != ref[j][0]
-        if error:  # we have a problem!
-            if len(src[i][0]) > len(ref[j][0]):
-                # Reference may have split this source word into many parts
-                new_j = aligner(src[i][0], ref, j)
-                if new_j != -1:
-                    log.info("SPLIT: %s --> %s" % (src[i][0], str(ref[j:new_j+1])))
-                    parts = ref[j:new_j + 1]
-                    right = (' '.join(p[0] for p in parts), min(1, sum(p[1] for p in parts)))
-                    j = new_j
-                    error = False
+def align_chunks(src_chunks, ref_chunks, window=20):
+    """
+    A quick fix for extra tokenizations in references, over streams of tagged chunks.
+    Tokens are aligned by their character offsets (ignoring white spaces) in a single pass:
+    groups of tokens on both sides are extended until they end at the same offset.
+    Where the texts disagree, the alignment is resumed at the nearest pair of matching tokens
+     within the window, and the tokens in between are skipped.
+    A group is started only when the window of tokens after it is buffered (or the input has ended), and
+     a group running past the buffered tokens is retried after reading the next chunk, so the alignment
+     does not depend on where the chunks end.
+    :param src_chunks: stream of (tokens, labels)
+    :param ref_chunks: stream of (tokens, labels)
+    :param window: number of tokens to look ahead for recovering from mismatches
+    :return: stream of aligned source, reference chunks as (tokens, labels); labels are int8 arrays
+    """
+    src_chunks, ref_chunks = iter(src_chunks), iter(ref_chunks)
+    src_toks, src_labels = [], array('b')
+    ref_toks, ref_labels = [], array('b')
+    src_more, ref_more = True, True         # there may be more chunks to read
+    need_src, need_ref = True, True
+    margin = window + 2                     # look ahead needed by resync()
+    stats = {'split': 0, 'merge': 0, 'skip_src': 0, 'skip_ref': 0}
+    totals = {'src': 0, 'ref': 0, 'aligned': 0}
+
+    def merge(toks, labels, start, end, res):
+        res_toks, res_labels = res
+        if end - start == 1:
+            res_toks.append(toks[start])
+            res_labels.append(labels[start])
+        else:
+            res_toks.append(' '.join(toks[start:end]))
+            res_labels.append(max(labels[start:end]))
+
+    while True:
+        if need_src and src_more:
+            chunk = next(src_chunks, None)
+            if chunk is None:
+                src_more = False
+            else:
+                src_toks.extend(chunk[0])
+                src_labels.extend(chunk[1])
+                totals['src'] += len(chunk[0])
+        if need_ref and ref_more:
+            chunk = next(ref_chunks, None)
+            if chunk is None:
+                ref_more = False
             else:
-                # Reference may have combined a few words
-                new_i = aligner(ref[j][0], src, i)
-                if new_i != -1:
-                    log.info("MERGE: %s --> %s" % (str(src[i: new_i+1]), ref[j][0]))
-                    parts = src[i: new_i + 1]
-                    left = (' '.join(p[0] for p in parts), min(1, sum(p[1] for p in parts)))
-                    i = new_i
-                    error = False
-
-        if error:
-            # try skipping one or two
-            if src[i][0] == ref[j+1][0]:
-                log.warning('Skip REF:%s' % ref[j][0])
-                j += 1
-                right = ref[j]
-            elif src[i+1][0] == ref[j][0]:
-                log.warning('Skip SRC:%s' % src[i][0])
-                i += 1
-                left = src[i]
-            elif src[i+1][0] == ref[j+1][0]:
-                log.warning('Skip SRC:%s  REF:%s' % (src[i][0], ref[j][0]))
-                i += 1      # skip both src[i] and ref[j]
-                j += 1
-                left = src[i]
-                right = ref[j]
-            else:     # failed to align
-                log.error("SRC:%s  REF:%s" % (src[max(0, i-3): min(len(src), i+4)], ref[max(0, j-3): min(len(ref), j+4)]))
-                raise Exception('Failed to align SRC:%s with REF:%s' % (src[i][0], ref[j][0]))
-
-        src_res.append(left)
-        ref_res.append(right)
-        i += 1
-        j += 1
-    if i < len(src):
-        log.error('SRC has left over tokens')
-    if j < len(ref):
-        log.error('REF has left over tokens')
-
-    assert len(src_res) == len(ref_res)
+                ref_toks.extend(chunk[0])
+                ref_labels.extend(chunk[1])
+                totals['ref'] += len(chunk[0])
+        n_src, n_ref = len(src_toks), len(ref_toks)
+        # groups start before these, so that the tokens seen by resync() are buffered
+        src_end = n_src - margin if src_more else n_src
+        ref_end = n_ref - margin if ref_more else n_ref
+
+        def resync(i, j):
+            # nearest (i+di, j+dj) where two consecutive tokens agree on both sides
+            for dist in range(1, 2 * window):
+                for di in range(max(0, dist - window), min(dist, window) + 1):
+                    a, b = i + di, j + dist - di
+                    if a < n_src and b < n_ref and src_toks[a] == ref_toks[b] \
+                            and (a + 1 == n_src or b + 1 == n_ref or src_toks[a + 1] == ref_toks[b + 1]):
+                        return a, b
+            return None
+
+        src_res, ref_res = ([], array('b')), ([], array('b'))
+        need_src, need_ref = False, False
+        i, j = 0, 0
+        while True:
+            if i >= src_end or j >= ref_end:
+                need_src, need_ref = i >= src_end and src_more, j >= ref_end and ref_more
+                break
+            si, sj = i, j
+            src_len, ref_len = len(src_toks[i]), len(ref_toks[j])
+            i, j = i + 1, j + 1
+            while src_len != ref_len:
+                if src_len < ref_len and i < n_src:
+                    src_len += len(src_toks[i])
+                    i += 1
+                elif ref_len < src_len and j < n_ref:
+                    ref_len += len(ref_toks[j])
+                    j += 1
+                else:
+                    break
+            if src_len != ref_len and (src_len < ref_len and src_more or ref_len < src_len and ref_more):
+                # the group runs past the buffered tokens, retry it with the next chunk
+                need_src, need_ref = src_len < ref_len, ref_len < src_len
+                i, j = si, sj
+                break
+            if src_len == ref_len and (i - si == j - sj == 1 and src_toks[si] == ref_toks[sj]
+                                       or ''.join(src_toks[si:i]) == ''.join(ref_toks[sj:j])):
+                if j - sj > 1:
+                    stats['split'] += 1
+                    log.debug("SPLIT: %s --> %s" % (src_toks[si], ref_toks[sj:j]))
+                if i - si > 1:
+                    stats['merge'] += 1
+                    log.debug("MERGE: %s --> %s" % (src_toks[si:i], ref_toks[sj]))
+                merge(src_toks, src_labels, si, i, src_res)
+                merge(ref_toks, ref_labels, sj, j, ref_res)
+                continue
+
+            # the texts disagree
+            nxt = resync(si, sj)
+            if nxt is None:
+                log.error("SRC:%s  REF:%s" % (src_toks[max(0, si-3): si+4], ref_toks[max(0, sj-3): sj+4]))
+                log.error('Could not align SRC:%s with REF:%s within %d tokens, skipping them'
+                          % (src_toks[si], ref_toks[sj], window))
+                nxt = si + 1, sj + 1
+            i, j = nxt
+            if i > si:
+                log.warning('Skip SRC:%s' % ' '.join(src_toks[si:i]))
+            if j > sj:
+                log.warning('Skip REF:%s' % ' '.join(ref_toks[sj:j]))
+            stats['skip_src'] += i - si
+            stats['skip_ref'] += j - sj
+
+        assert len(src_res[0]) == len(ref_res[0])
+        if src_res[0]:
+            totals['aligned'] += len(src_res[0])
+            yield src_res, ref_res
+        del src_toks[:i], src_labels[:i], ref_toks[:j], ref_labels[:j]
+        if not need_src and not need_ref:
+            break
+
+    if src_toks:
+        log.error('SRC has %d left over tokens' % len(src_toks))
+    if ref_toks:
+        log.error('REF has %d left over tokens' % len(ref_toks))
+    log.info("Tokens: SRC:%d  REF:%d  Aligned:%d" % (totals['src'], totals['ref'], totals['aligned']))
+    log.info("Alignment: %s" % stats)
+
+
+def fix_tokenization(src, ref, window=20):
+    """
+    A quick fix for extra tokenizations in references, see align_chunks()
+    :param src: tokens, labels
+    :param ref: tokens, labels
+    :param window: number of tokens to look ahead for recovering from mismatches
+    :return: source, reference as (tokens, labels) after aligning the tokens; labels are int8 arrays
+    """
+    src_res, ref_res = ([], array('b')), ([], array('b'))
+    for src_chunk, ref_chunk in align_chunks([src], [ref], window=window):
+        for res, chunk in ((src_res, src_chunk), (ref_res, ref_chunk)):
+            res[0].extend(chunk[0])
+            res[1].extend(chunk[1])
     return src_res, ref_res
 
 
-def confusion_matrix(out, ref):
+def confusion_matrix(out, ref, errors=None, max_errors=1000, start=0, end=None):
     """
     returns a confusion matrix.
     Interpretation (x,y) : 10 means 10 records which are marked 'x' in reference, but predicted as 'y'.
     Note that this interpretation is valid only when first argument is predictions and second argument is gold labels
-    :param out:
-    :param ref:
-    :return:
+    :param out: aligned predictions as (tokens, labels)
+    :param ref: aligned gold as (tokens, labels)
+    :param errors: optional file to write examples of errors with their context
+    :param max_errors: maximum number of error examples to write
+    :param start: first position to count, the positions before it are only used as context of the errors
+    :param end: end of the positions to count, default is all
+    :return: dict of (gold, pred) -> count
     """
-    assert len(out) == len(ref)
-    tab = dict((x, 0) for x in ((0, 0), (0, 1), (1, 0), (1, 1)))
-    print(len(out), len(ref))
-    for i, ((pt, pred), (gt, gold)) in enumerate(zip(out, ref)):
-        assert pt.replace(' ', '') == gt.replace(' ', ''), '%s -- %s' % (pt, gt)
-        if pred != gold:
-            #print("False Negative::")
-            print('OUT:' + ' '.join(map(lambda x: x[0] + ('**' if x[1] else ''),  out[i-10:i+10])))
-            print('REF:' + ' '.join(map(lambda x: x[0] + ('**' if x[1] else ''), ref[i - 10:i + 10])))
-            print("===")
-        tab[gold, pred] += 1
+    assert len(out[1]) == len(ref[1])
+    end = len(out[1]) if end is None else end
+    preds = np.frombuffer(out[1], dtype=np.int8)[start:end]    # no copy, the labels are int8 arrays
+    golds = np.frombuffer(ref[1], dtype=np.int8)[start:end]
+    counts = np.bincount(2 * golds.astype(np.int64) + preds, minlength=4)
+    tab = dict(((gold, pred), int(counts[2 * gold + pred])) for gold in (0, 1) for pred in (0, 1))
+    if errors and max_errors > 0:
+        def context(tagged, i):
+            toks, labels = tagged
+            return ' '.join(tok + ('**' if label else '')
+                            for tok, label in zip(toks[max(0, i - 10): i + 10], labels[max(0, i - 10): i + 10]))
+        for i in np.flatnonzero(preds != golds)[:max_errors]:
+            errors.write('OUT:%s\nREF:%s\n===\n' % (context(out, start + i), context(ref, start + i)))
     return tab
 
 
-def evaluate(src, ref, out, model=None):
+def prf(tab, label=1):
+    """
+    Computes precision, recall and F1 of a label from confusion matrix
+    :param tab: confusion matrix, as returned by confusion_matrix()
+    :param label: label of interest, default is 1 (sentence ending)
+    :return: precision, recall, f1
+    """
+    other = 1 - label
+    tp, fp, fn = tab[label, label], tab[other, label], tab[label, other]
+    precision = tp / (tp + fp) if tp + fp > 0 else 0.0
+    recall = tp / (tp + fn) if tp + fn > 0 else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return precision, recall, f1
+
+
+def evaluate(src, ref, out, model=None, errors=None, max_errors=1000, chunk_size=10000):
+    """
+    Evaluates the splitter output against the reference.
+    The output and reference are read, tagged, aligned and counted together in chunks, so the memory
+     does not grow with the size of the files.
+    :param src: source file, only its lines are counted
+    :param ref: reference file
+    :param out: splitter output file
+    :param model: optional model path, its tokenizer is used
+    :param errors: optional file to write examples of errors
+    :param max_errors: maximum number of error examples
+    :param chunk_size: number of lines read at a time
+    :return: confusion matrix
+    """
     def read_lines(fptr):
         for line in fptr:
             line = line.strip()
             if line:
                 yield line
 
-    src_recs = list(read_lines(src))
-    out_recs = list(read_lines(out))
-    ref_recs = list(read_lines(ref))
-
+    num_src = sum(1 for _ in read_lines(src))
     tokenizer = None
     if model:
         model = SeqSplitter.load(model)
         tokenizer = model.tokenize
-    log.info("Recs   :Output:%s  Reference:%s" % (len(out_recs), len(ref_recs)))
-    ref_toks = list(tag_line_breaks(ref_recs, tokenizer=tokenizer))
-    out_toks = list(tag_line_breaks(out_recs, tokenizer=tokenizer))
+    out_chunks = tag_chunks(read_lines(out), tokenizer=tokenizer, chunk_size=chunk_size)
+    ref_chunks = tag_chunks(read_lines(ref), tokenizer=tokenizer, chunk_size=chunk_size)
+
+    mat = dict(((gold, pred), 0) for gold in (0, 1) for pred in (0, 1))
+    ctx = 10    # tokens of context for the error examples, they are kept across the chunks
+    out_buf, ref_buf = ([], array('b')), ([], array('b'))
+    start = 0   # positions before start are counted, they are kept only as context
+
+    def count(end):
+        nonlocal max_errors
+        tab = confusion_matrix(out_buf, ref_buf, errors=errors, max_errors=max_errors, start=start, end=end)
+        for key, val in tab.items():
+            mat[key] += val
+        max_errors -= min(max_errors, tab[0, 1] + tab[1, 0])
 
-    log.info("Tokens: Output:%s  Reference:%s" % (len(out_toks), len(ref_toks)))
-    out_toks, ref_toks = fix_tokenization(out_toks, ref_toks)
-    log.info("Tokens: Output:%s  Reference:%s" % (len(out_toks), len(ref_toks)))
+    for out_chunk, ref_chunk in align_chunks(out_chunks, ref_chunks):
+        for buf, chunk in ((out_buf, out_chunk), (ref_buf, ref_chunk)):
+            buf[0].extend(chunk[0])
+            buf[1].extend(chunk[1])
+        end = len(out_buf[0]) - ctx
+        if end > start:
+            count(end)
+            keep = max(0, end - ctx)
+            for buf in (out_buf, ref_buf):
+                del buf[0][:keep], buf[1][:keep]
+            start = end - keep
+    count(len(out_buf[0]))
 
-    mat = confusion_matrix(out_toks, ref_toks)
     print('Confusion Matrix 1:', mat)
-    print("Source already has %d line breaks. So, reducing them" % len(src_recs))
-    mat[1, 1] -= len(src_recs)
+    print("Source already has %d line breaks. So, reducing them" % num_src)
+    mat[1, 1] -= num_src
     print('Confusion Matrix 2:', mat)
+    print('Precision: %.4f  Recall: %.4f  F1: %.4f' % prf(mat))
+    return mat
 
 
 if __name__ == '__main__':
@@ -165,4 +315,6 @@ if __name__ == '__main__':
     p.add_argument('-r', '--ref', help='Reference file', type=argparse.FileType('r'), required=True)
     p.add_argument('-o', '--out', help='Splitter output file', type=argparse.FileType('r'), default=sys.stdin)
     p.add_argument('-m', '--model', help='Model. Used for tokenizing', required=False)
+    p.add_argument('-e', '--errors', help='File to write examples of errors', type=argparse.FileType('w'))
+    p.add_argument('-n', '--max-errors', help='Maximum number of error examples, default=1000', type=int, default=1000)
     evaluate(**vars(p.parse_args()))
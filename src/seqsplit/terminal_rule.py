@@ -3,16 +3,25 @@
 # Usage :
     # Train
     $ cat  <train_dir>/*.txt | python ./src/seqsplit/terminal_rule.py learn ssplit-1B-rules.pkl -vv -ci
+    # Train on many cores
+    $ ls <train_dir>/*.txt | python ./src/seqsplit/terminal_rule.py learn ssplit-1B-rules.pkl -ci -mf -workers 16
     # Split
     $ cat  <test_dir>/*.txt | python ./src/seqsplit/terminal_rule.py split ssplit-1B-rules.pkl
+    # Split many files on many cores
+    $ ls <test_dir>/*.txt | python ./src/seqsplit/terminal_rule.py split ssplit-1B-rules.pkl -mf -workers 16
 
 ---
 Author  : Thamme Gowda
 Created : Nov 29, 2017
 """
 
-from collections import defaultdict
-from seqsplit import SeqSplitter
+import pickle
+from collections import defaultdict, deque
+import logging as log
+from parallel import ordered_map, read_blocks, file_shards, read_shard
+from seqsplit import SeqSplitter, ModelFile, CountsView
+from sink import Sink, STDOUT
+from instrument import profiler
 
 
 class TerminalSplitter(SeqSplitter):
@@ -37,6 +46,8 @@ class TerminalSplitter(SeqSplitter):
         self.nocase = nocase
         self.openers = set(c[0] for c in covers)
         self.closures = set(c[1] for c in covers)
+        self.decisions = None        # compiled from exceptions, see compile()
+        self.ends = None             # last chars of terminals
 
         for c in self.closures:
             for t in terminals:
@@ -44,45 +55,77 @@ class TerminalSplitter(SeqSplitter):
                 self.terminals[t2] = self.Marker(t2, context)
 
     def tokenize(self, seq):
+        return self.tokenize_marked(seq)[0]
+
+    def tokenize_marked(self, seq):
+        """
+        Tokenizes the sequence, and finds the terminal tokens in the same pass
+        :param seq: raw sequence
+        :return: tokens, indices of terminal tokens
+        """
         toks = super(TerminalSplitter, self).tokenize(seq)
+        terminals = self.terminals
 
         """Groups tokens that are wrongly split"""
-        # Detokenizes by using a look ahead.
-        res = []
-        last = None
-        for tok in toks:
-            if last is None:
-                last = tok
-            else:
-                if tok in self.closures and last in self.terminals:
-                    # print('{0} {1} -->  {0}{1}'.format(last, tok))
-                    res.append('%s%s' % (last, tok))     # remove split
-                    last = None
-                else:
-                    res.append(last)
+        # Detokenizes by using a look ahead. Most sequences dont have closures, they are skipped
+        if not self.closures.isdisjoint(toks):
+            res = []
+            last = None
+            for tok in toks:
+                if last is None:
                     last = tok
-        if last is not None:
-            res.append(last)
+                else:
+                    if tok in self.closures and last in terminals:
+                        # print('{0} {1} -->  {0}{1}'.format(last, tok))
+                        res.append('%s%s' % (last, tok))     # remove split
+                        last = None
+                    else:
+                        res.append(last)
+                        last = tok
+            if last is not None:
+                res.append(last)
+            toks = res
 
         # check if terminals are not tokenized properly
         # examples: hello? yes!!! Cool..
-        seq, res = res, []
-        for tok in seq:
-            if tok in self.terminals:
-                res.append(tok)
+        ends = getattr(self, 'ends', None) or self._terminal_ends()
+        res, marks = [], []
+        append, extend, mark = res.append, res.extend, marks.append
+        for tok in toks:
+            if tok[-1] not in ends:
+                # cant be a terminal, or have one attached
+                append(tok)
+            elif tok in terminals:
+                mark(len(res))
+                append(tok)
+            elif tok[-1] in terminals:
+                # last char is attached
+                mark(len(res) + 1)
+                extend((tok[:-1], tok[-1]))
+            elif tok[-2:] in terminals:
+                # last two chars are attached
+                if tok[-2] in terminals:
+                    mark(len(res) + 1)
+                extend((tok[:-2], tok[-2]))
             else:
-                if tok[-1] in self.terminals:
-                    # last char is attached
-                    res.extend([tok[:-1], tok[-1]])
-                elif tok[-2:] in self.terminals:
-                    # last two chars are attached
-                    res.extend([tok[:-2], tok[-2]])
-                else:
-                    # just add
-                    res.append(tok)
-        return res
+                # just add
+                append(tok)
+        return res, marks
 
-    def learn(self, seqs, verbose=False):
+    def _terminal_ends(self):
+        """
+        :return: set of last chars of terminals; the tokens ending with other chars are skipped by tokenize
+        """
+        self.ends = frozenset(t[-1] for t in self.terminals)
+        return self.ends
+
+    def count(self, seqs):
+        """
+        Updates the exception counts from the sequences, without pruning the rare ones
+        :param seqs: stream of tokenized sequences
+        :return: number of sequences
+        """
+        self.thaw()
         count = 0
         for seq in seqs:
             count += 1
@@ -101,7 +144,36 @@ class TerminalSplitter(SeqSplitter):
             # False Negative -- watch for other terminals
             if seq[-1] not in self.terminals:
                 self.other_terminals[seq[-1]] += 1
+        self.decisions = None     # exceptions are updated, the decision table has to be recompiled
+        return count
+
+    def get_counts(self):
+        """
+        :return: exception counts as plain dicts {terminal: {context: {token: count}}}, other terminals
+        """
+        excepts = dict((tok, dict((ctx, dict(data)) for ctx, data in tokdata.exceptions.items()))
+                       for tok, tokdata in self.terminals.items())
+        return excepts, dict(self.other_terminals)
+
+    def merge_counts(self, excepts, other_terminals):
+        """
+        Adds partial counts (say, learned from a shard of corpus) to this model
+        :param excepts: exception counts {terminal: {context: {token: count}}}
+        :param other_terminals: counts of other terminals
+        :return:
+        """
+        self.thaw()
+        for tok, tokdata in excepts.items():
+            for ctx, data in tokdata.items():
+                mine = self.terminals[tok].exceptions[ctx]
+                for key, val in data.items():
+                    mine[key] += val
+        for key, val in other_terminals.items():
+            self.other_terminals[key] += val
+        self.decisions = None
 
+    def prune(self):
+        self.thaw()
         if self.min_obs >= 1:
             for tok, tokdata in self.terminals.items():
                 for ctx, data in tokdata.exceptions.items():
@@ -109,54 +181,318 @@ class TerminalSplitter(SeqSplitter):
                     for key, val in list(data.items()):
                         if val < self.min_obs:
                             del data[key]
+        self.decisions = None
+
+    def print_stats(self, count):
+        from pprint import pprint
+        for tok, tokdata in self.terminals.items():
+            print("== %s" % tok)
+            for ctx, data in tokdata.exceptions.items():
+                print("======== %s===" % ctx)
+                pprint(sorted(data.items(), key=lambda x: x[1], reverse=True))
+        print("Other terminals::")
+        pprint(self.other_terminals)
+        print("Learned from %d records" % count)
+
+    def learn(self, seqs, verbose=False):
+        count = self.count(seqs)
+        self.prune()
         if verbose:
-            # Print
-            from pprint import pprint
-            for tok, tokdata in self.terminals.items():
-                print("== %s" % tok)
-                for ctx, data in tokdata.exceptions.items():
-                    print("======== %s===" % ctx)
-                    pprint(sorted(data.items(), key=lambda x: x[1], reverse=True))
-            print("Other terminals::")
-            pprint(self.other_terminals)
-            print("Learned from %d records" % count)
+            self.print_stats(count)
+
+    def prepare(self, lines):
+        """
+        Prepares lines for learning
+        :param lines: raw lines
+        :return: stream of tokenized sequences
+        """
+        for line in lines:
+            if self.nocase:
+                line = line.lower()
+            line = line.strip()
+            if line:
+                yield self.tokenize(line)
 
+    @profiler.timed('learn')
     def learn_from(self, lines, verbose=False):
-        def prepare():
-            for line in lines:
-                if self.nocase:
-                    line = line.lower()
-                line = line.strip()
-                if line:
-                    yield self.tokenize(line)
-        seq = prepare()
-        self.learn(seq, verbose=verbose)
+        self.learn(self.prepare(lines), verbose=verbose)
+
+    @profiler.timed('learn')
+    def learn_parallel(self, paths, workers=None, shard_size=64 * 1024 * 1024, verbose=False):
+        """
+        Learns from files using a pool of workers.
+        The files are cut into shards of lines, workers count the exceptions in shards,
+         and the partial counts are summed before pruning. The result is same as learn_from() on all the files.
+        :param paths: paths to files
+        :param workers: number of worker processes, default is number of CPUs
+        :param shard_size: approximate size (in bytes) of a shard
+        :param verbose: print stats
+        :return:
+        """
+        from multiprocessing import Pool, cpu_count
+        self.thaw()     # the model is copied to the workers
+        shards = [shard for path in paths for shard in file_shards(path, shard_size)]
+        log.info("Learning from %d files, %d shards" % (len(paths), len(shards)))
+        workers = workers or cpu_count()
+        if len(shards) < workers:
+            log.warning("Only %d shards for %d workers, some workers will be idle" % (len(shards), workers))
+        count = 0
+        with Pool(workers, initializer=_init_learner, initargs=(self,)) as pool:
+            # merge as they arrive, memory is bounded by the vocabulary
+            for excepts, other_terminals, shard_count in pool.imap_unordered(_learn_shard, shards):
+                self.merge_counts(excepts, other_terminals)
+                count += shard_count
+        self.prune()
+        if verbose:
+            self.print_stats(count)
+
+    @profiler.timed('learn')
+    def learn_blocks(self, lines, workers=None, block_size=100000, verbose=False):
+        """
+        Learns from a stream of lines, such as STDIN, using a pool of workers.
+        The lines are grouped into blocks, workers count the exceptions in blocks,
+         and the partial counts are summed before pruning. The result is same as learn_from() on the lines.
+        :param lines: stream of lines
+        :param workers: number of worker processes, default is number of CPUs
+        :param block_size: number of lines in a block
+        :param verbose: print stats
+        :return:
+        """
+        self.thaw()     # the model is copied to the workers
+        count = 0
+        for excepts, other_terminals, block_count in ordered_map(_learn_lines, read_blocks(lines, block_size),
+                                                                 workers=workers, initializer=_init_learner,
+                                                                 initargs=(self,)):
+            self.merge_counts(excepts, other_terminals)
+            count += block_count
+        self.prune()
+        if verbose:
+            self.print_stats(count)
+
+    def to_compact(self):
+        strings, str_idx = [], {}
+
+        def intern(tok):
+            if tok not in str_idx:
+                str_idx[tok] = len(strings)
+                strings.append(tok)
+            return str_idx[tok]
+
+        terminals = sorted(self.terminals.keys())
+        # groups: (terminal index, context, start, end) of exceptions in keys and counts arrays
+        groups, keys, counts = [], [], []
+        for term_idx, term in enumerate(terminals):
+            for ctx, data in self.terminals[term].exceptions.items():
+                start = len(keys)
+                for tok, val in sorted(data.items()):    # sorted: same model => same file
+                    keys.append(intern(tok))
+                    counts.append(val)
+                groups.extend((term_idx, ctx, start, len(keys)))
+        other_terminals = sorted(self.other_terminals.items())
+        other_keys = [intern(tok) for tok, _ in other_terminals]
+        other_counts = [val for _, val in other_terminals]
+        meta = {'version': self.version,
+                'terminals': terminals,
+                'contexts': [list(self.terminals[t].exceptions.keys()) for t in terminals],
+                'min_obs': self.min_obs,
+                'nocase': self.nocase,
+                'openers': sorted(self.openers),
+                'closures': sorted(self.closures)}
+        arrays = {'groups': groups, 'keys': keys, 'counts': counts,
+                  'other_keys': other_keys, 'other_counts': other_counts}
+        arrays = dict((name, ModelFile.int_array(vals)) for name, vals in arrays.items())
+        return meta, strings, arrays
+
+    @classmethod
+    def from_compact(cls, meta, strings, arrays):
+        """
+        The exceptions are served from the arrays of model file, they are not copied into dicts.
+        So the memory of a model loaded by many processes is shared. The counts are copied when learning, see thaw()
+        """
+        self = cls.__new__(cls)
+        self.version = meta['version']
+        self.min_obs = meta['min_obs']
+        self.nocase = meta['nocase']
+        self.openers = set(meta['openers'])
+        self.closures = set(meta['closures'])
+        self.decisions = None
+        self.ends = None
+        terminals = meta['terminals']
+        self.terminals = dict((t, self.Marker(t, tuple(ctx))) for t, ctx in zip(terminals, meta['contexts']))
+        keys, counts, groups = arrays['keys'], arrays['counts'], arrays['groups']
+        for i in range(0, len(groups), 4):
+            term_idx, ctx, start, end = groups[i: i + 4]
+            self.terminals[terminals[term_idx]].exceptions[ctx] = CountsView(strings, keys[start:end],
+                                                                             counts[start:end])
+        self.other_terminals = CountsView(strings, arrays['other_keys'], arrays['other_counts'])
+        return self
+
+    def thaw(self):
+        """
+        Copies the read only counts of a model loaded from compact file into dicts, so that they can be updated
+        """
+        for marker in self.terminals.values():
+            for ctx, data in marker.exceptions.items():
+                if isinstance(data, CountsView):
+                    marker.exceptions[ctx] = defaultdict(int, data.items())
+                    self.decisions = None
+        if isinstance(self.other_terminals, CountsView):
+            self.other_terminals = defaultdict(int, self.other_terminals.items())
+
+    def compile(self):
+        """
+        Compiles the exceptions into a decision table.
+        For each terminal, the table has a tuple of (relative_ctx_idx, frozenset(exception_tokens))
+        :return: decision table
+        """
+        def positive(excepts):
+            if isinstance(excepts, CountsView):
+                return excepts.positive()       # looked up in the model file
+            return frozenset(tok for tok, val in excepts.items() if val > 0)
+
+        self.decisions = dict((term, tuple((rel_idx, positive(excepts))
+                                           for rel_idx, excepts in marker.exceptions.items()))
+                              for term, marker in self.terminals.items())
+        return self.decisions
 
     def split(self, long_seq):
-        if not seq:
-            return seq
+        if not long_seq:
+            return long_seq
+        decisions = getattr(self, 'decisions', None) or self.compile()
+        marks = [i for i in range(1, len(long_seq)) if long_seq[i] in decisions]
+        return self._split(long_seq, marks, decisions)
+
+    def _split(self, long_seq, marks, decisions):
+        """
+        :param long_seq: tokens
+        :param marks: indices of terminals in the tokens
+        :param decisions: decision table, see compile()
+        :return: list of splits
+        """
+        n = len(long_seq)
+        nocase = self.nocase
         res = []
         left = 0
-        for idx in range(1, len(long_seq)):
-            if long_seq[idx] in self.terminals:
-                do_split = True
-                model = self.terminals[long_seq[idx]]
-                for rel_ctx_idx, exepts in model.exceptions.items():
-                    tru_ctx_idx = rel_ctx_idx + idx
-                    if 0 <= tru_ctx_idx < len(long_seq):
-                        tok = long_seq[tru_ctx_idx]
-                        if self.nocase:
-                            tok = tok.lower()
-                        if exepts.get(tok, 0) > 0:
-                            do_split = False           # its a false pos, dont split
-                if do_split:
-                    res.append(long_seq[left: idx + 1])
-                    left = idx + 1
-
-        if left < len(long_seq):    # left over sequence ending
+        for idx in marks:
+            if idx == 0:
+                continue
+            for rel_ctx_idx, excepts in decisions[long_seq[idx]]:
+                tru_ctx_idx = rel_ctx_idx + idx
+                if 0 <= tru_ctx_idx < n:
+                    tok = long_seq[tru_ctx_idx]
+                    if (tok.lower() if nocase else tok) in excepts:
+                        break       # its a false pos, dont split
+            else:
+                res.append(long_seq[left: idx + 1])
+                left = idx + 1
+
+        if left < n:    # left over sequence ending
             res.append(long_seq[left:])
         return res
 
+    def split_all(self, seqs):
+        """
+        Splits many raw sequences in one call.
+        The terminals are found while tokenizing, so the tokens are not scanned again for splitting
+        :param seqs: raw sequences (untokenized strings)
+        :return: list of splits for each sequence
+        """
+        decisions = getattr(self, 'decisions', None) or self.compile()
+        tokenize, split = self.tokenize_marked, self._split
+        res = []
+        for seq in seqs:
+            toks, marks = tokenize(seq)
+            res.append(split(toks, marks, decisions) if toks else toks)
+        return res
+
+
+_learner = {}
+
+
+def _init_learner(model):
+    _learner['template'] = pickle.dumps(model)
+
+
+def _learn_lines(lines):
+    # a copy of the model with the same config, but with empty counts
+    model = pickle.loads(_learner['template'])
+    model.terminals = dict((tok, model.Marker(tok, tuple(marker.exceptions.keys())))
+                           for tok, marker in model.terminals.items())
+    model.other_terminals = defaultdict(int)
+    count = model.count(model.prepare(lines))
+    excepts, other_terminals = model.get_counts()
+    return excepts, other_terminals, count
+
+
+def _learn_shard(shard):
+    return _learn_lines(read_shard(*shard))
+
+
+_splitter = {}
+
+
+def _init_splitter(model_path):
+    _splitter['model'] = SeqSplitter.load(model_path)
+
+
+def _split_block(block):
+    model = _splitter['model']
+    detokenize = model.detokenize
+    return [detokenize(seg) for segs in model.split_all(block) for seg in segs]
+
+
+@profiler.timed('split')
+def split_stream(model_path, inp, out, multi_file=False, workers=1, block_size=5000):
+    """
+    Splits the input using a pool of workers, each loads the model once.
+    Blocks of lines are split in parallel and the output is written in the order of input.
+    :param model_path: path to the model
+    :param inp: input lines, or list of file paths when multi_file=True
+    :param out: output to write the splits
+    :param multi_file: the input is a list of file paths. the output is prefixed by '<file_name>:<split_num>'
+    :param workers: number of worker processes
+    :param block_size: number of lines in a block
+    :return:
+    """
+    def read_lines(lines):
+        return (line.strip() for line in lines if line.strip())
+
+    def jobs():
+        if multi_file:
+            for file_idx, path in enumerate(read_lines(inp)):
+                doc_id = path.split('/')[-1]
+                with open(path) as f:
+                    for block in read_blocks(read_lines(f), block_size):
+                        yield (file_idx, doc_id), block
+        else:
+            yield from ((None, block) for block in read_blocks(read_lines(inp), block_size))
+
+    # doc_ids stay in this process, only the blocks go to workers
+    doc_ids = deque()
+
+    def blocks():
+        for doc, block in jobs():
+            doc_ids.append(doc)
+            yield block
+
+    last_file, count = None, 0
+    for segs in ordered_map(_split_block, blocks(), workers=workers,
+                            initializer=_init_splitter, initargs=(model_path,)):
+        doc = doc_ids.popleft()
+        profiler.count('split', len(segs))
+        with profiler.stage('format'):      # formatting and buffering, Sink times the writes as 'write'
+            if multi_file:
+                # numbering restarts for each input file, even when the files have the same name
+                file_idx, doc_id = doc
+                if file_idx != last_file:
+                    last_file, count = file_idx, 0
+                for seg in segs:
+                    count += 1
+                    out.write('%s:%d\t%s\n' % (doc_id, count, seg))
+            elif segs:
+                out.write('\n'.join(segs))
+                out.write('\n')
+
 
 if __name__ == '__main__':
     import argparse
@@ -165,42 +501,40 @@ if __name__ == '__main__':
     p.add_argument('command', nargs=1, help='action command', choices=['learn', 'split'])
     p.add_argument('model', nargs=1, help="model")
     p.add_argument('-in', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
-    p.add_argument('-out', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+    p.add_argument('-out', nargs='?', default=STDOUT, help="Output file. Default is STDOUT")
     p.add_argument('-ci', action='store_true', help="Case Insensitive")
     p.add_argument('-vv', action='store_true', help="Print stats")
     p.add_argument('-mf', action='store_true', help="Multi File Input. The input is a list of paths")
     p.add_argument('-min_obs', default=4, type=int, help="Minimum Observation of exceptions, default=4")
+    p.add_argument('-workers', default=1, type=int, help="Number of worker processes, default=1")
+    profiler.add_argument(p)
 
     args = vars(p.parse_args())
 
     cmd = args['command'][0]
     model = args['model'][0]
-    if cmd == 'learn':
-        spltr = TerminalSplitter(min_observations=args['min_obs'], nocase=args['ci'])
-        spltr.learn_from(args['in'], verbose=args['vv'])
-        spltr.save(model)
-
-    elif cmd == 'split':
-        doc_id = ''
-        multi_file = args['mf']
-        spltr = SeqSplitter.load(model)
-        for rec in args['in']:
-            count = 0
-            rec = rec.strip()
-            seqs = [rec]
-            if multi_file:
-                doc_id = rec.split('/')[-1]
-                with open(rec) as f:
-                    seqs = f.readlines()
-            seqs = (seq.strip() for seq in seqs if seq.strip())
-            for seq in seqs:
-                splits = spltr.split(spltr.tokenize(seq))
-                for split in splits:
-                    if multi_file:
-                        count += 1
-                        args['out'].write('%s:%d\t' % (doc_id, count))
-                    args['out'].write(spltr.detokenize(split))
-                    args['out'].write("\n")
-                #args['out'].write("\n")
-    else:
-        raise Exception()
+    with profiler.session(args['profile'], args['pstats']):
+        if cmd == 'learn':
+            spltr = TerminalSplitter(min_observations=args['min_obs'], nocase=args['ci'])
+            if args['mf'] and args['workers'] > 1:
+                paths = [line.strip() for line in args['in'] if line.strip()]
+                spltr.learn_parallel(paths, workers=args['workers'], verbose=args['vv'])
+            elif args['mf']:
+                def read_files():
+                    for line in args['in']:
+                        if line.strip():
+                            with open(line.strip()) as f:
+                                yield from f
+                spltr.learn_from(read_files(), verbose=args['vv'])
+            elif args['workers'] > 1:
+                spltr.learn_blocks(args['in'], workers=args['workers'], verbose=args['vv'])
+            else:
+                spltr.learn_from(args['in'], verbose=args['vv'])
+            with profiler.stage('write'):
+                spltr.save(model)
+
+        elif cmd == 'split':
+            with Sink(args['out']) as out:
+                split_stream(model, args['in'], out, multi_file=args['mf'], workers=args['workers'])
+        else:
+            raise Exception()
@@ -0,0 +1,172 @@
+"""
+Buffered output sink with optional compression.
+
+Records are collected in a large buffer and written in batches.
+When compression is enabled, the batches are compressed and written by a background thread
+(zlib and zstd release the GIL while compressing), so the producer is not blocked.
+The batch writes (including the compression) are timed as the 'write' stage of instrument.profiler;
+in the threaded mode this time is spent by the background thread, in parallel to the producer.
+
+Usage:
+    with Sink('out.txt.gz') as out:
+        for rec in recs:
+            out.writeline(rec)
+"""
+
+import sys
+import threading
+import zlib
+from queue import Queue
+from instrument import profiler
+
+__version__ = '0.1'
+
+COMPRESSIONS = {'gzip': ('.gz', '.gzip'), 'zstd': ('.zst', '.zstd')}
+STDOUT = '-'
+
+
+def guess_compression(path):
+    """
+    Guesses the compression from file extension
+    :param path: file path
+    :return: name of compression or None
+    """
+    for name, exts in COMPRESSIONS.items():
+        if path.endswith(exts):
+            return name
+    return None
+
+
+def get_compressor(compress, level=None):
+    """
+    Creates a streaming compressor having compress(bytes) and flush() methods
+    :param compress: name of compression {gzip, zstd}
+    :param level: compression level, None for the default level
+    :return: compressor object
+    """
+    if compress == 'gzip':
+        # wbits=31 : gzip header and trailer
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+    elif compress == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception('zstd compression requires "zstandard" package. Run: pip install zstandard')
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    raise Exception('Unknown compression %s. Known: %s' % (compress, list(COMPRESSIONS.keys())))
+
+
+class Sink(object):
+    """
+    Buffered writer, optionally compressing the output on a background thread
+    """
+
+    def __init__(self, path, compress=None, level=None, buffer_size=1 << 20, threaded=None, encoding='utf-8'):
+        """
+        :param path: file path; '-' for STDOUT. It can also be an opened binary file object
+        :param compress: compression {gzip, zstd, None}. Default is to guess from the file extension
+        :param level: compression level
+        :param buffer_size: number of characters to buffer before writing a batch
+        :param threaded: compress and write on a background thread. Default is true when compressing
+        :param encoding: text encoding
+        """
+        self.path = path
+        if isinstance(path, str):
+            if compress is None:
+                compress = guess_compression(path)
+            self.own_file = path != STDOUT
+            self.file = open(path, 'wb') if self.own_file else sys.stdout.buffer
+        else:
+            self.own_file = False
+            self.file = path
+        self.compressor = get_compressor(compress, level) if compress else None
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.buf = []
+        self.buf_len = 0
+        self.error = None
+        self.closed = False
+
+        if threaded is None:
+            threaded = self.compressor is not None
+        self.queue, self.thread = None, None
+        if threaded:
+            self.queue = Queue(maxsize=8)   # bounded, so that a slow disk doesnt fill the memory
+            self.thread = threading.Thread(target=self._consume, name='sink-writer', daemon=True)
+            self.thread.start()
+
+    def write(self, text):
+        self.buf.append(text)
+        self.buf_len += len(text)
+        if self.buf_len >= self.buffer_size:
+            self._flush_buffer()
+
+    def writeline(self, text):
+        self.write(text)
+        self.write('\n')
+
+    def writelines(self, lines):
+        """
+        Writes the lines as they are, like io; the new lines are not added
+        """
+        for line in lines:
+            self.write(line)
+
+    def _flush_buffer(self):
+        if not self.buf:
+            return
+        data = ''.join(self.buf).encode(self.encoding)
+        self.buf, self.buf_len = [], 0
+        if self.queue is not None:
+            if self.error:
+                raise self.error
+            self.queue.put(data)
+        else:
+            self._emit(data)
+
+    def _emit(self, data):
+        with profiler.stage('write'):
+            if self.compressor:
+                data = self.compressor.compress(data)
+            if data:
+                self.file.write(data)
+
+    def _consume(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error:
+                continue        # drain the queue so that the producer doesnt block
+            try:
+                self._emit(data)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            try:
+                self._flush_buffer()
+            finally:
+                if self.thread is not None:
+                    self.queue.put(None)
+                    self.thread.join()
+            if self.error:
+                raise self.error
+            if self.compressor:
+                with profiler.stage('write'):
+                    self.file.write(self.compressor.flush())
+        finally:
+            if self.own_file:
+                self.file.close()
+            else:
+                self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
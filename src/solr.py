@@ -1,6 +1,4 @@
 
-import requests
-
 #from functools32.functools32 import lru_cache
 from functools import lru_cache
 import logging as log
@@ -23,6 +21,7 @@ class Solr(object):
             for key in kwargs:
                 payload[key] = kwargs.get(key)
         #print("Query", payload)
+        import requests     # imported here, so that importing this module is fast
         resp = requests.get(self.url, params=payload)
         if resp.status_code == 200:
             result = eval(resp.text)
@@ -42,6 +41,7 @@ class Solr(object):
             for key in kwargs:
                 payload[key] = kwargs.get(key)
         #print("Query", payload)
+        import requests
         resp = requests.get(self.url, params=payload)
         if resp.status_code == 200:
             return eval(resp.text)['response']